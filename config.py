@@ -1,18 +1,116 @@
 """Configuration settings for the Cloud Migration Simulation."""
 
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
-# Load environment variables from .env file if it exists
+# Load environment variables from .env file if it exists (never overrides variables already set)
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except ImportError:
     pass  # python-dotenv is optional
 
+# On-disk record of recently validated (provider, model, key) combinations
+VALIDATION_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "cloudmig", "validate.json")
+VALIDATION_CACHE_TTL_SECONDS = 24 * 60 * 60
 
-@dataclass
+
+def _read_validation_cache() -> dict:
+    """Load the validation cache; a missing or corrupt file counts as empty."""
+    try:
+        with open(VALIDATION_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_validation_cache(data: dict) -> None:
+    """Atomically write the validation cache. Failures are ignored (cache is best-effort)."""
+    try:
+        os.makedirs(os.path.dirname(VALIDATION_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{VALIDATION_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, VALIDATION_CACHE_PATH)
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=4)
+def get_openai_client(api_key: str):
+    """Shared OpenAI client per API key, so its HTTP connection pool is reused."""
+    try:
+        import openai
+    except ImportError:
+        raise ImportError("openai package not installed. Run: pip install openai") from None
+    return openai.OpenAI(api_key=api_key)
+
+
+@functools.lru_cache(maxsize=4)
+def get_anthropic_client(api_key: str):
+    """Shared Anthropic client per API key, so its HTTP connection pool is reused."""
+    try:
+        import anthropic
+    except ImportError:
+        raise ImportError("anthropic package not installed. Run: pip install anthropic") from None
+    return anthropic.Anthropic(api_key=api_key)
+
+
+# Async clients per event loop: {loop: {(provider, api_key): client}}. Their connection pools are
+# bound to the loop that created them, so a client is never reused from another loop.
+_ASYNC_CLIENTS: Dict[asyncio.AbstractEventLoop, Dict[Tuple[str, str], Any]] = {}
+
+
+def _async_clients_for_running_loop() -> Dict[Tuple[str, str], Any]:
+    """Client dict for the running loop; entries of loops closed without aclose_async_clients() are dropped."""
+    loop = asyncio.get_running_loop()
+    for other in list(_ASYNC_CLIENTS):
+        if other.is_closed():
+            _ASYNC_CLIENTS.pop(other, None)
+    return _ASYNC_CLIENTS.setdefault(loop, {})
+
+
+def get_async_openai_client(api_key: str):
+    """Shared AsyncOpenAI client per API key for the running event loop."""
+    clients = _async_clients_for_running_loop()
+    client = clients.get(("openai", api_key))
+    if client is None:
+        try:
+            import openai
+        except ImportError:
+            raise ImportError("openai package not installed. Run: pip install openai") from None
+        client = clients[("openai", api_key)] = openai.AsyncOpenAI(api_key=api_key)
+    return client
+
+
+def get_async_anthropic_client(api_key: str):
+    """Shared AsyncAnthropic client per API key for the running event loop."""
+    clients = _async_clients_for_running_loop()
+    client = clients.get(("anthropic", api_key))
+    if client is None:
+        try:
+            import anthropic
+        except ImportError:
+            raise ImportError("anthropic package not installed. Run: pip install anthropic") from None
+        client = clients[("anthropic", api_key)] = anthropic.AsyncAnthropic(api_key=api_key)
+    return client
+
+
+async def aclose_async_clients() -> None:
+    """Close the running loop's async clients and their connection pools; call before the loop ends."""
+    clients = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+@dataclass(slots=True)
 class CompletionConditions:
     """Completion conditions for the simulation."""
     MIN_PERSONAS: int = 2
@@ -20,7 +118,7 @@ class CompletionConditions:
     REQUIRE_STRATEGY: bool = True
 
 
-@dataclass
+@dataclass(slots=True)
 class LLMConfig:
     """LLM API configuration."""
     provider: str = "openai"  # "openai" or "anthropic"
@@ -28,6 +126,7 @@ class LLMConfig:
     api_key: Optional[str] = None
     temperature: float = 0.7
     max_tokens: int = 500
+    max_prompt_tokens: int = 6000  # Persona prompts above this are trimmed before sending
 
     def __post_init__(self):
         """Load API key from environment if not provided."""
@@ -37,38 +136,78 @@ class LLMConfig:
             elif self.provider == "anthropic":
                 self.api_key = os.getenv("ANTHROPIC_API_KEY")
 
+    def get_client(self):
+        """Get the shared client for this provider and API key."""
+        if self.provider == "openai":
+            return get_openai_client(self.api_key)
+        elif self.provider == "anthropic":
+            return get_anthropic_client(self.api_key)
+        raise ValueError(f"Unsupported LLM provider: {self.provider}")
+
+    def get_async_client(self):
+        """
+        Get the shared async client for this provider, API key and the running event loop.
+        Must be called from a coroutine; each asyncio.run() gets its own client
+        (close them with aclose_async_clients() before the loop ends).
+        """
+        if self.provider == "openai":
+            return get_async_openai_client(self.api_key)
+        elif self.provider == "anthropic":
+            return get_async_anthropic_client(self.api_key)
+        raise ValueError(f"Unsupported LLM provider: {self.provider}")
+
+    def warm_up(self) -> None:
+        """
+        Build the shared client and open a connection with a request that uses no tokens
+        (model listing), so the first real call skips the SDK import, client setup and DNS/TLS.
+        Best-effort: any error is ignored. Older anthropic SDKs (requirements allow >=0.18) have no
+        models endpoint; there the client is still built and imported, only the connection stays cold.
+        """
+        try:
+            client = self.get_client()
+            if self.provider == "openai":
+                client.models.list()
+            elif hasattr(client, "models"):  # anthropic
+                client.models.list(limit=1)
+        except Exception:
+            pass
+
+    def _validation_cache_key(self) -> str:
+        """Cache key for validate_api; the raw API key is never stored."""
+        key_hash = hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{self.provider}|{self.model}|{key_hash}".encode("utf-8")).hexdigest()
+
     def validate_api(self) -> None:
         """
         Verify that the API key is valid and the provider is reachable.
-        Performs a minimal API call. Raises on failure.
+        Performs a minimal API call unless the same provider/model/key passed
+        within VALIDATION_CACHE_TTL_SECONDS. Raises on failure.
         """
         if not self.api_key:
             raise ValueError("API key is not set")
+        cache_key = self._validation_cache_key()
+        cache = _read_validation_cache()
+        now = time.time()
+        expiry = cache.get(cache_key)
+        if isinstance(expiry, (int, float)) and now < expiry:
+            return
         try:
+            try:
+                client = self.get_client()
+            except ImportError as e:
+                raise ValueError(str(e)) from None
             if self.provider == "openai":
-                try:
-                    import openai
-                except ImportError:
-                    raise ValueError("openai package not installed. Run: pip install openai") from None
-                client = openai.OpenAI(api_key=self.api_key)
                 client.chat.completions.create(
                     model=self.model,
                     messages=[{"role": "user", "content": "Say OK"}],
                     max_tokens=5,
                 )
-            elif self.provider == "anthropic":
-                try:
-                    import anthropic
-                except ImportError:
-                    raise ValueError("anthropic package not installed. Run: pip install anthropic") from None
-                client = anthropic.Anthropic(api_key=self.api_key)
+            else:  # anthropic
                 client.messages.create(
                     model=self.model,
                     max_tokens=5,
                     messages=[{"role": "user", "content": "Say OK"}],
                 )
-            else:
-                raise ValueError(f"Unsupported LLM provider: {self.provider}")
         except ValueError:
             raise
         except Exception as e:
@@ -81,11 +220,16 @@ class LLMConfig:
                 raise ValueError(f"Model '{self.model}' not found or not available for {self.provider}.") from e
             raise ValueError(f"API check failed ({self.provider}): {e}") from e
 
+        # Drop expired entries while recording the new one
+        cache = {k: v for k, v in cache.items() if isinstance(v, (int, float)) and v > now}
+        cache[cache_key] = now + VALIDATION_CACHE_TTL_SECONDS
+        _write_validation_cache(cache)
+
 
-@dataclass
+@dataclass(slots=True)
 class SimulationConfig:
     """Simulation configuration."""
-    max_rounds: int = os.environ.get("SIMULATION_MAX_ROUNDS", 4)
+    max_rounds: int = int(os.environ.get("SIMULATION_MAX_ROUNDS", 4))
     completion_conditions: CompletionConditions = None
     llm_config: LLMConfig = None
 
@@ -1,12 +1,60 @@
 """Evaluation engine for simulation sessions."""
 
-from typing import Dict, List, Any
+import re
+import string
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Any, Optional, Tuple
 from dataclasses import dataclass
 
 from state import State
 
+# Considerations the user is expected to discuss; matched in one pass over the history
+_CONSIDERATION_RE = re.compile(r"monitoring|rollback|roll back|testing")
 
-@dataclass
+# Strategy -> (points, evaluation note); unlisted strategies score 0
+STRATEGY_SCORING: Dict[str, Tuple[int, str]] = {
+    "adapter_layer": (2, "Chose migration-friendly strategy"),
+    "abstraction": (2, "Chose migration-friendly strategy"),
+    "hybrid": (2, "Chose migration-friendly strategy"),
+    "rewrite": (1, "Chose rewrite strategy (higher risk)"),
+}
+
+# Most points any strategy earns, and the strategies that earn them
+MAX_STRATEGY_POINTS = max(points for points, _ in STRATEGY_SCORING.values())
+MIGRATION_FRIENDLY_STRATEGIES = frozenset(
+    k for k, (points, _) in STRATEGY_SCORING.items() if points == MAX_STRATEGY_POINTS
+)
+
+# Constraints every plan is expected to cover (in gap report order)
+_COMMON_CONSTRAINTS = ("time", "cost", "security", "downtime")
+
+# Human-readable text for risk flags in the gap report
+_RISK_FLAG_LABELS = {
+    "rewrite_conflicts_with_time_pressure": "Rewrite strategy conflicts with stated time pressure",
+}
+
+# Risk flag -> (penalty points, evaluation note)
+RISK_PENALTIES: Dict[str, Tuple[int, str]] = {
+    "rewrite_conflicts_with_time_pressure": (2, "⚠️ Rewrite conflicts with stated time constraints"),
+}
+
+# Constraint -> (points, evaluation note, score breakdown label); order is the report order
+CONSTRAINT_SCORING: Dict[str, Tuple[int, str, str]] = {
+    "downtime": (2, "Considered availability / downtime", "Downtime / availability"),
+    "security": (2, "Considered security implications", "Security / compliance"),
+    "cost": (1, "Considered cost implications", "Cost / budget"),
+    "perf": (1, "Considered performance under load", "Performance / scalability"),
+    "time": (1, "Considered time constraints", "Time / deadlines"),
+    "partial_docs": (1, "Considered documentation gaps", "Documentation gaps"),
+}
+
+
+# EvaluationReport.strategy when the user never chose one
+NO_STRATEGY = "None selected"
+
+
+@dataclass(slots=True)
 class EvaluationReport:
     """Evaluation report structure."""
     score: int
@@ -18,48 +66,65 @@ class EvaluationReport:
     recommendations: List[str]
 
 
+# Memoized reports, keyed by _evaluation_key (least recently used evicted first)
+_REPORT_CACHE_SIZE = 64
+_report_cache: "OrderedDict[Tuple, EvaluationReport]" = OrderedDict()
+# Sessions evaluate from their own threads; the lock covers cache bookkeeping only
+_report_cache_lock = threading.Lock()
+
+
+def _evaluation_key(state: State) -> Tuple:
+    """Hashable snapshot of every state field the evaluation reads.
+    History is append-only within a session, so its length stands in for its content."""
+    return (
+        state.session_id,
+        len(state.history),
+        state.strategy_selected,
+        frozenset(state.constraints_addressed),
+        frozenset(state.personas_triggered),
+        tuple(state.risk_flags),
+    )
+
+
 def evaluate_session(state: State) -> EvaluationReport:
-    """Evaluate the simulation session and generate a report."""
+    """Evaluate the simulation session and generate a report (memoized per state snapshot)."""
+    key = _evaluation_key(state)
+    with _report_cache_lock:
+        report = _report_cache.get(key)
+        if report is not None:
+            _report_cache.move_to_end(key)
+            return report
+    report = _build_report(state)
+    with _report_cache_lock:
+        _report_cache[key] = report
+        if len(_report_cache) > _REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    return report
+
+
+def _build_report(state: State) -> EvaluationReport:
+    """Compute the evaluation report from scratch."""
     score = 0
     notes = []
     
     # Strategy scoring
-    if state.strategy_selected in ["adapter_layer", "abstraction", "hybrid"]:
-        score += 2
-        notes.append("Chose migration-friendly strategy")
-    elif state.strategy_selected == "rewrite":
-        score += 1
-        notes.append("Chose rewrite strategy (higher risk)")
+    strategy_entry = STRATEGY_SCORING.get(state.strategy_selected)
+    if strategy_entry is not None:
+        score += strategy_entry[0]
+        notes.append(strategy_entry[1])
     
     # Constraint coverage scoring
-    if "downtime" in state.constraints_addressed:
-        score += 2
-        notes.append("Considered availability / downtime")
-    
-    if "security" in state.constraints_addressed:
-        score += 2
-        notes.append("Considered security implications")
-    
-    if "cost" in state.constraints_addressed:
-        score += 1
-        notes.append("Considered cost implications")
-    
-    if "perf" in state.constraints_addressed:
-        score += 1
-        notes.append("Considered performance under load")
-    
-    if "time" in state.constraints_addressed:
-        score += 1
-        notes.append("Considered time constraints")
-    
-    if "partial_docs" in state.constraints_addressed:
-        score += 1
-        notes.append("Considered documentation gaps")
+    addressed = state.constraints_addressed
+    for constraint, (points, note, _) in CONSTRAINT_SCORING.items():
+        if constraint in addressed:
+            score += points
+            notes.append(note)
     
     # Penalties for risk flags
-    if "rewrite_conflicts_with_time_pressure" in state.risk_flags:
-        score -= 2
-        notes.append("⚠️ Rewrite conflicts with stated time constraints")
+    for flag, (penalty, note) in RISK_PENALTIES.items():
+        if flag in state.risk_flags:
+            score -= penalty
+            notes.append(note)
     
     # Clamp score to 0-10
     score = max(0, min(10, score))
@@ -75,7 +140,7 @@ def evaluate_session(state: State) -> EvaluationReport:
     
     return EvaluationReport(
         score=score,
-        strategy=state.strategy_selected or "None selected",
+        strategy=state.strategy_selected or NO_STRATEGY,
         personas_used=list(state.personas_triggered),
         constraints_covered=list(state.constraints_addressed),
         strengths=strengths,
@@ -110,10 +175,9 @@ def detect_gaps(state: State) -> List[str]:
     gaps = []
     
     # Missing common constraints (show with display names)
-    common_constraints = ["time", "cost", "security", "downtime"]
-    missing = [c for c in common_constraints if c not in state.constraints_addressed]
+    missing = [c for c in _COMMON_CONSTRAINTS if c not in state.constraints_addressed]
     if missing:
-        labels = [CONSTRAINT_DISPLAY_NAMES.get(c, c.replace("_", " ").title()) for c in missing]
+        labels = [constraint_label(c) for c in missing]
         gaps.append("Did not address: " + ", ".join(labels))
     
     # Missing strategy
@@ -125,20 +189,18 @@ def detect_gaps(state: State) -> List[str]:
         gaps.append("Limited stakeholder engagement")
     
     # Risk flags indicate gaps (show human-readable text in report)
-    _RISK_FLAG_LABELS = {
-        "rewrite_conflicts_with_time_pressure": "Rewrite strategy conflicts with stated time pressure",
-    }
     if state.risk_flags:
         labels = [_RISK_FLAG_LABELS.get(flag, flag.replace("_", " ")) for flag in state.risk_flags]
         gaps.append("Risk conflicts detected: " + "; ".join(labels))
     
     # Common missing considerations
     missing_considerations = []
-    if "monitoring" not in str(state.history).lower():
+    mentioned = set(_CONSIDERATION_RE.findall(state.history_text()))
+    if "monitoring" not in mentioned:
         missing_considerations.append("monitoring/observability")
-    if "rollback" not in str(state.history).lower() and "roll back" not in str(state.history).lower():
+    if "rollback" not in mentioned and "roll back" not in mentioned:
         missing_considerations.append("rollback strategy")
-    if "testing" not in str(state.history).lower():
+    if "testing" not in mentioned:
         missing_considerations.append("testing approach")
     
     if missing_considerations:
@@ -172,13 +234,14 @@ def generate_recommendations(gaps: List[str], state: State) -> List[str]:
     if len(state.personas_triggered) < 3:
         recommendations.append("Engage with more stakeholders (PM, DevOps, CTO) to get diverse perspectives")
     
-    if "monitoring" in str(gaps).lower():
+    gaps_text = str(gaps).lower()
+    if "monitoring" in gaps_text:
         recommendations.append("Plan for monitoring and observability in the new cloud environment")
     
-    if "rollback" in str(gaps).lower():
+    if "rollback" in gaps_text:
         recommendations.append("Develop a rollback strategy in case migration issues arise")
     
-    if "testing" in str(gaps).lower():
+    if "testing" in gaps_text:
         recommendations.append("Define testing strategy for migrated services")
     
     # Risk mitigation
@@ -188,96 +251,101 @@ def generate_recommendations(gaps: List[str], state: State) -> List[str]:
     return recommendations if recommendations else ["Continue practicing migration planning scenarios"]
 
 
-def format_final_review_message(state: State) -> str:
-    """Format a final review message asking user about their final strategy and showing gaps."""
-    gaps = detect_gaps(state)
-    recommendations = generate_recommendations(gaps, state)
-    
-    strategy_display = (state.strategy_selected or "Not selected").replace("_", " ").title()
-    constraints_display = _display_constraints(list(state.constraints_addressed))
-    message = f"""
+# Static parts of the final review message
+_FINAL_REVIEW_HEADER = string.Template("""
 ## Final review round
 
 Before we conclude, let's review your migration strategy:
 
-- **Strategy:** {strategy_display}
-- **Constraints addressed:** {constraints_display}
+- **Strategy:** ${strategy}
+- **Constraints addressed:** ${constraints}
 
-"""
-    
-    if gaps and len(gaps) > 0 and gaps[0] != "No major gaps detected":
-        message += "**⚠️  Potential Gaps to Consider:**\n"
-        for i, gap in enumerate(gaps, 1):
-            message += f"  {i}. {gap}\n"
-        message += "\n"
-    
-    if recommendations and len(recommendations) > 0:
-        message += "**💡  Recommendations to Improve:**\n"
-        for i, rec in enumerate(recommendations, 1):
-            message += f"  {i}. {rec}\n"
-        message += "\n"
-    
-    message += """## Question: ##\n
+""")
+
+_FINAL_REVIEW_QUESTION = """## Question: ##\n
 **Is this your final migration strategy?**
 
 If you'd like to refine your approach based on the gaps and recommendations above, please share your updated strategy or any additional considerations.
 
 Type your response to confirm or update your strategy...
 """
+
+
+def format_final_review_message(state: State, report: Optional[EvaluationReport] = None) -> str:
+    """
+    Format a final review message asking user about their final strategy and showing gaps.
+    Reuses the gaps/recommendations of report (or of the memoized evaluate_session) instead of recomputing them.
+    """
+    if report is None:
+        report = evaluate_session(state)
+    gaps = report.gaps
+    recommendations = report.recommendations
+    
+    strategy_display = (state.strategy_selected or "Not selected").replace("_", " ").title()
+    constraints_display = _display_constraints(state.constraints_addressed)
+    parts = [_FINAL_REVIEW_HEADER.safe_substitute(strategy=strategy_display, constraints=constraints_display)]
+    
+    if gaps and len(gaps) > 0 and gaps[0] != "No major gaps detected":
+        parts.append("**⚠️  Potential Gaps to Consider:**\n")
+        parts.extend(f"  {i}. {gap}\n" for i, gap in enumerate(gaps, 1))
+        parts.append("\n")
+    
+    if recommendations and len(recommendations) > 0:
+        parts.append("**💡  Recommendations to Improve:**\n")
+        parts.extend(f"  {i}. {rec}\n" for i, rec in enumerate(recommendations, 1))
+        parts.append("\n")
+    
+    parts.append(_FINAL_REVIEW_QUESTION)
     
-    return message
+    return "".join(parts)
 
 
 def explain_score(state: State, report: EvaluationReport) -> str:
-    """Generate detailed explanation of the score and what's missing."""
-    explanation = "\n**Score breakdown** (max 10 points)\n\n"
+    """
+    Generate detailed explanation of the score and what's missing.
+    Strategy and constraint lines come from report; state is read only for the risk flags, which the report does not carry.
+    """
+    parts = ["\n**Score breakdown** (max 10 points)\n\n"]
+    covered = set(report.constraints_covered)
     
     # Strategy points
-    if state.strategy_selected in ["adapter_layer", "abstraction", "hybrid"]:
-        explanation += f"- Strategy: **2/2** (chose {state.strategy_selected.replace('_', ' ')})\n"
-    elif state.strategy_selected == "rewrite":
-        explanation += "- Strategy: **1/2** (rewrite — higher risk)\n"
+    strategy_entry = STRATEGY_SCORING.get(report.strategy)
+    if strategy_entry is None:
+        parts.append(f"- Strategy: **0/{MAX_STRATEGY_POINTS}** (not selected)\n")
     else:
-        explanation += "- Strategy: **0/2** (not selected)\n"
-    
-    constraint_points = {
-        "downtime": (2, "Downtime / availability"),
-        "security": (2, "Security / compliance"),
-        "cost": (1, "Cost / budget"),
-        "perf": (1, "Performance / scalability"),
-        "time": (1, "Time / deadlines"),
-        "partial_docs": (1, "Documentation gaps")
-    }
-    
-    for constraint, (points, display_name) in constraint_points.items():
-        if constraint in state.constraints_addressed:
-            explanation += f"- {display_name}: **{points}/{points}**\n"
+        points = strategy_entry[0]
+        name = report.strategy.replace("_", " ")
+        detail = f"chose {name}" if points == MAX_STRATEGY_POINTS else f"{name} — higher risk"
+        parts.append(f"- Strategy: **{points}/{MAX_STRATEGY_POINTS}** ({detail})\n")
+    
+    for constraint, (points, _, display_name) in CONSTRAINT_SCORING.items():
+        if constraint in covered:
+            parts.append(f"- {display_name}: **{points}/{points}**\n")
         else:
-            explanation += f"- {display_name}: **0/{points}**\n"
+            parts.append(f"- {display_name}: **0/{points}**\n")
     
-    if state.risk_flags:
-        explanation += "\n- Risk penalties: **-2** (conflicting choices)\n"
+    penalty = sum(points for flag, (points, _) in RISK_PENALTIES.items() if flag in state.risk_flags)
+    if penalty:
+        parts.append(f"\n- Risk penalties: **-{penalty}** (conflicting choices)\n")
     
-    explanation += f"\n**Total: {report.score}/10**\n"
+    parts.append(f"\n**Total: {report.score}/10**\n")
     
     missing_points = 10 - report.score
     if missing_points > 0:
-        explanation += f"\n**How to improve** (+{missing_points} point(s) to reach 10/10)\n\n"
+        parts.append(f"\n**How to improve** (+{missing_points} point(s) to reach 10/10)\n\n")
         tips = []
-        if not state.strategy_selected:
+        if report.strategy == NO_STRATEGY:
             tips.append("Select a migration strategy (adapter layer, abstraction, hybrid, or rewrite)")
-        for constraint in constraint_points:
-            if constraint not in state.constraints_addressed:
-                _, display_name = constraint_points[constraint]
+        for constraint, (_, _, display_name) in CONSTRAINT_SCORING.items():
+            if constraint not in covered:
                 tips.append(f"Address {display_name.lower()}")
-        if state.risk_flags:
+        if penalty:
             tips.append("Resolve conflicting requirements (e.g. rewrite vs. time pressure)")
-        for t in tips:
-            explanation += f"- {t}\n"
+        parts.extend(f"- {t}\n" for t in tips)
     else:
-        explanation += "\nAll key aspects covered.\n"
+        parts.append("\nAll key aspects covered.\n")
     
-    return explanation
+    return "".join(parts)
 
 
 # Human-readable labels for constraints (no abbreviations in reports)
@@ -291,18 +359,23 @@ CONSTRAINT_DISPLAY_NAMES = {
 }
 
 
+def constraint_label(constraint: str) -> str:
+    """Display name for a constraint key, e.g. perf -> Performance."""
+    return CONSTRAINT_DISPLAY_NAMES.get(constraint, constraint.replace("_", " ").title())
+
+
 def _display_strategy(raw: str) -> str:
     """Human-friendly strategy label; never show 'None'."""
-    if not raw or raw == "None selected" or str(raw).strip().lower() == "none":
+    if not raw or raw == NO_STRATEGY or str(raw).strip().lower() == "none":
         return "—"
     return raw.replace("_", " ").strip().title()
 
 
-def _display_constraints(constraints_list: list) -> str:
+def _display_constraints(constraints_list: Iterable[str]) -> str:
     """Human-friendly constraints list with full names."""
     if not constraints_list:
         return "—"
-    return ", ".join(CONSTRAINT_DISPLAY_NAMES.get(c, c.replace("_", " ").title()) for c in constraints_list)
+    return ", ".join(constraint_label(c) for c in constraints_list)
 
 
 def _display_list(items: list, empty_label: str = "—") -> str:
@@ -312,13 +385,8 @@ def _display_list(items: list, empty_label: str = "—") -> str:
     return ", ".join(str(x) for x in items)
 
 
-def format_feedback(report: EvaluationReport, state: State) -> str:
-    """Format evaluation report as human-readable feedback."""
-    strategy_text = _display_strategy(report.strategy)
-    personas_text = _display_list(report.personas_used)
-    constraints_text = _display_constraints(report.constraints_covered)
-
-    feedback = """
+# Summary table at the top of the final feedback
+_FEEDBACK_SUMMARY = string.Template("""
 ---
 
 ## Simulation finished
@@ -327,17 +395,30 @@ def format_feedback(report: EvaluationReport, state: State) -> str:
 
 | | |
 |---|---|
-| **Strategy** | """ + strategy_text + """ |
-| **Personas encountered** | """ + personas_text + """ |
-| **Constraints covered** | """ + constraints_text + """ |
-| **Score** | """ + str(report.score) + """/10 |
+| **Strategy** | ${strategy} |
+| **Personas encountered** | ${personas} |
+| **Constraints covered** | ${constraints} |
+| **Score** | ${score}/10 |
 
-"""
-    feedback += explain_score(state, report)
-    feedback += "\n**Strengths**\n\n"
+""")
+
+
+def format_feedback(report: EvaluationReport, state: State) -> str:
+    """Format evaluation report as human-readable feedback."""
+    strategy_text = _display_strategy(report.strategy)
+    personas_text = _display_list(report.personas_used)
+    constraints_text = _display_constraints(report.constraints_covered)
+
+    summary = _FEEDBACK_SUMMARY.safe_substitute(
+        strategy=strategy_text,
+        personas=personas_text,
+        constraints=constraints_text,
+        score=report.score,
+    )
+    parts = [summary, explain_score(state, report), "\n**Strengths**\n\n"]
     for strength in report.strengths:
         line = strength.strip()
         if line:
-            feedback += f"- {line}\n"
-    feedback += "\n---\n"
-    return feedback
+            parts.append(f"- {line}\n")
+    parts.append("\n---\n")
+    return "".join(parts)
@@ -1,10 +1,11 @@
 """Web GUI for Cloud Migration Simulation - group chat style."""
 
+import functools
 import os
 import re
 import streamlit as st
 
-from simulation import SimulationController
+from evaluation import constraint_label
 from config import config
 
 # Apply max_rounds from main entry point (when launched via main.py --gui)
@@ -19,16 +20,26 @@ PERSONA_DISPLAY = {
     "CTO": ("Michael", "CTO", "👔"),
 }
 
-# Constraint labels for sidebar (no abbreviations)
-CONSTRAINT_DISPLAY = {
-    "time": "Time",
-    "cost": "Cost",
-    "security": "Security",
-    "perf": "Performance",
-    "downtime": "Downtime / availability",
-    "partial_docs": "Documentation",
+# Display tuples bound once so message parsing returns them without a dict lookup
+_SCENARIO = PERSONA_DISPLAY["Scenario"]
+_PM = PERSONA_DISPLAY["PM"]
+_DEVOPS = PERSONA_DISPLAY["DevOps"]
+_CTO = PERSONA_DISPLAY["CTO"]
+
+# Lowercase name/role tokens -> display tuple, checked in order (PM, DevOps, CTO)
+_SPEAKER_TOKENS = {
+    "sarah": _PM,
+    "pm": _PM,
+    "product manager": _PM,
+    "alex": _DEVOPS,
+    "devops": _DEVOPS,
+    "michael": _CTO,
+    "cto": _CTO,
 }
 
+# Agent messages are formatted "[Name (Role)]: message" by SimulationController;
+# name, optional role and body are captured in one pass
+_FULL_RE = re.compile(r"^\[([^(\]]+?)\s*(?:\(([^)]+)\))?\]:\s*(.*)", re.DOTALL)
 
 def _format_strategy_for_sidebar(raw: str) -> str:
     """Strategy with title case, e.g. adapter_layer -> Adapter layer."""
@@ -41,42 +52,52 @@ def _format_constraints_for_sidebar(constraints: list) -> str:
     """Constraints as full names, e.g. perf -> Performance."""
     if not constraints:
         return ""
-    return ", ".join(CONSTRAINT_DISPLAY.get(c, c.replace("_", " ").title()) for c in constraints)
-
-
-def _parse_agent_message(content: str) -> tuple[str, str]:
-    """Parse '[Name (Role)]: message' into (speaker, message)."""
-    match = re.match(r"^\[([^\]]+)\]:\s*(.*)", content, re.DOTALL)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    return "Scenario", content
-
-
-def _speaker_to_display(speaker: str) -> tuple[str, str, str]:
-    """Map speaker string to (display_name, role_label, avatar)."""
-    if speaker == "Scenario":
-        return PERSONA_DISPLAY["Scenario"]
-    # Match known personas by name or role in "Name (Role)" format
-    s = speaker.lower()
-    if "Sarah" in s or "pm" in s or "product manager" in s:
-        name, role, avatar = PERSONA_DISPLAY["PM"]
-        return name, role, avatar
-    if "Alex" in s or "devops" in s:
-        name, role, avatar = PERSONA_DISPLAY["DevOps"]
-        return name, role, avatar
-    if "Michael" in s or "cto" in s:
-        name, role, avatar = PERSONA_DISPLAY["CTO"]
-        return name, role, avatar
-    # Fallback: try to parse "Name (Role)" for display
-    match = re.match(r"^([^(]+)\s*\(([^)]+)\)\s*$", speaker.strip())
-    if match:
-        return match.group(1).strip(), match.group(2).strip(), "👤"
-    return speaker, "", "👤"
+    return ", ".join(constraint_label(c) for c in constraints)
+
+
+@functools.lru_cache(maxsize=64)
+def _constraint_bullets(constraints: tuple) -> str:
+    """Sidebar bullet list for a constraints tuple (rebuilt only when the set changes)."""
+    return "  \n".join(f"• {constraint_label(c)}" for c in constraints)
+
+
+def _parse_agent(content: str) -> tuple[str, str, str, str]:
+    """Parse '[Name (Role)]: message' into (display_name, role_label, avatar, body)."""
+    match = _FULL_RE.match(content) if content.startswith("[") else None
+    if not match:
+        return (*_SCENARIO, content)
+    name, role, body = match.group(1).strip(), match.group(2), match.group(3).strip()
+    if name == "Scenario" and role is None:
+        return (*_SCENARIO, body)
+    # Match known personas by name first, then by any name/role token
+    display = _SPEAKER_TOKENS.get(name.lower())
+    if display is None:
+        s = f"{name} ({role})".lower() if role else name.lower()
+        display = next((d for token, d in _SPEAKER_TOKENS.items() if token in s), None)
+    if display is not None:
+        return (*display, body)
+    return name, (role or "").strip(), "👤", body
+
+
+def _agent_message(content: str) -> dict:
+    """Build an agent chat entry, parsing speaker and display info once at append time."""
+    display_name, role_label, avatar, body = _parse_agent(content)
+    return {
+        "role": "agent",
+        "content": content,
+        "body": body,
+        "display_name": display_name,
+        "role_label": role_label,
+        "avatar": avatar,
+    }
 
 
 def init_session():
     """Initialize simulation and session state."""
     if "simulation" not in st.session_state:
+        # Deferred: only needed once per session, not on every rerun before the key check
+        from simulation import SimulationController
+
         user_id = (
             os.environ.get("SIMULATION_USER_ID")
             or st.session_state.get("user_id")
@@ -88,7 +109,7 @@ def init_session():
             initial_message = st.session_state.simulation.initialize()
             st.session_state.messages = []
             # Append initial context as "Scenario"
-            st.session_state.messages.append({"role": "agent", "content": initial_message})
+            st.session_state.messages.append(_agent_message(initial_message))
         except Exception as e:
             st.error(f"Error initializing simulation: {e}")
             st.info("Ensure OPENAI_API_KEY or ANTHROPIC_API_KEY is set (or create a .env file)")
@@ -101,76 +122,52 @@ def _persona_label(display_name: str, role_label: str) -> str:
     return display_name
 
 
+def _render_user_bubble(content: str, render_ctx: tuple[str, bool, str]) -> None:
+    """Render one Candidate message; show the name only if a custom user ID is set."""
+    user_id, is_valid_name, display_label = render_ctx
+    with st.chat_message(display_label, avatar="🧑"):
+        # If no name is provided, only show the Role
+        if is_valid_name:
+            st.caption(f"**Name:** {user_id}  \n**Role:** Candidate")
+        else:
+            st.caption("**Role:** Candidate")
+        st.markdown(content)
+
+
+def _render_agent_bubble(msg: dict) -> None:
+    """Render one agent message from the fields parsed in _agent_message."""
+    display_name, role_label = msg["display_name"], msg["role_label"]
+    label = _persona_label(display_name, role_label)
+    with st.chat_message(label, avatar=msg["avatar"]):
+        if role_label and (display_name, role_label, msg["avatar"]) != _SCENARIO:
+            st.caption(f"**Name:** {display_name}  \n**Role:** {role_label}")
+        st.markdown(msg["body"])
+
+
 def render_chat():
     """Render chat messages with conditional name display for the Candidate."""
     messages = st.session_state.get("messages", [])
-    
-    # Get the user ID from the sidebar input
-    user_id = st.session_state.get("user_id_input", "").strip()
+    render_ctx = st.session_state["_render_ctx"]
 
     for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
-        
-        if role == "user":
-            # Determine display name: use ID if provided and not default, otherwise generic label
-            is_valid_name = user_id and user_id != "default_user"
-            display_label = user_id if is_valid_name else "Candidate"
-            
-            with st.chat_message(display_label, avatar="🧑"):
-                # If no name is provided, only show the Role
-                if is_valid_name:
-                    st.caption(f"**Name:** {user_id}  \n**Role:** Candidate")
-                else:
-                    st.caption(f"**Role:** Candidate")
-                st.markdown(content)
+        if msg["role"] == "user":
+            _render_user_bubble(msg["content"], render_ctx)
         else:
-            # Agent rendering logic (stays the same)
-            speaker, body = _parse_agent_message(content)
-            display_name, role_label, avatar = _speaker_to_display(speaker)
-            label = _persona_label(display_name, role_label)
-            with st.chat_message(label, avatar=avatar):
-                if role_label and speaker != "Scenario":
-                    st.caption(f"**Name:** {display_name}  \n**Role:** {role_label}")
-                st.markdown(body)
-
-
-def main():
-    st.set_page_config(
-        page_title="Cloud Migration Simulation",
-        page_icon="☁️",
-        layout="centered",
-        initial_sidebar_state="collapsed",
-    )
+            _render_agent_bubble(msg)
 
-    # LLM is required: block running without API key
-    if not config.llm_config.api_key:
-        st.error("LLM API key is required. This application cannot run without an LLM.")
-        st.info("Set OPENAI_API_KEY or ANTHROPIC_API_KEY in your environment or in a .env file, then restart.")
-        st.stop()
-
-    # Validate API once per session before allowing simulation
-    if not st.session_state.get("api_validated"):
-        with st.spinner("Checking LLM API..."):
-            try:
-                config.llm_config.validate_api()
-                st.session_state["api_validated"] = True
-            except ValueError as e:
-                st.error(f"API check failed: {e}")
-                st.stop()
 
+def render_sidebar():
+    """Render settings and round info. Drawn after the turn is processed so it is current without a rerun."""
     # Optional user ID in sidebar
     with st.sidebar:
         st.header("Settings")
         default_uid = os.environ.get("SIMULATION_USER_ID", "default_user")
         user_id = st.text_input("User ID", value=default_uid, key="user_id_input")
-        if "user_id" not in st.session_state or st.session_state.user_id != user_id:
-            st.session_state.user_id = user_id
         st.session_state.user_id = user_id
 
         if st.session_state.get("simulation"):
-            state = st.session_state.simulation.get_state()
-            round_info = st.session_state.simulation.get_round_info()
+            snapshot = st.session_state.simulation.get_round_snapshot()
+            state, round_info = snapshot.state, snapshot.round_info
             if state.in_final_review or st.session_state.get("simulation_ended"):
                 st.metric("Round", "—")
             else:
@@ -180,68 +177,86 @@ def main():
             constraints = round_info.get("constraints_addressed") or []
             st.markdown("**Constraints**")
             if constraints:
-                for c in constraints:
-                    label = CONSTRAINT_DISPLAY.get(c, c.replace("_", " ").title())
-                    st.caption(f"• {label}")
+                # One element per list instead of one per item (fewer deltas sent to the browser)
+                st.caption(_constraint_bullets(tuple(constraints)))
             else:
                 st.caption("None yet. In your replies, mention at least: time/deadlines, cost/budget, security, or downtime/availability.")
             st.markdown("**Personas:**")
             if round_info["personas_triggered"]:
+                persona_lines = []
                 for key in round_info["personas_triggered"]:
                     name, role, _ = PERSONA_DISPLAY.get(key, (key, "", "👤"))
-                    st.caption(f"• {name} — {role}")
+                    persona_lines.append(f"• {name} — {role}")
+                st.caption("  \n".join(persona_lines))
             else:
                 st.caption("None yet mentioned.")
             if state.in_final_review:
                 st.warning("Final Review Round")
 
+
+def main():
+    st.set_page_config(
+        page_title="Cloud Migration Simulation",
+        page_icon="☁️",
+        layout="centered",
+        initial_sidebar_state="collapsed",
+    )
+
+    # LLM is required: block running without API key
+    if not config.llm_config.api_key:
+        st.error("LLM API key is required. This application cannot run without an LLM.")
+        st.info("Set OPENAI_API_KEY or ANTHROPIC_API_KEY in your environment or in a .env file, then restart.")
+        st.stop()
+
+    # Validate API once per session before allowing simulation
+    if not st.session_state.get("api_validated"):
+        with st.spinner("Checking LLM API..."):
+            try:
+                config.llm_config.validate_api()
+                st.session_state["api_validated"] = True
+            except ValueError as e:
+                st.error(f"API check failed: {e}")
+                st.stop()
+
     # Title
     st.title("☁️ Cloud Migration Simulation")
     st.caption("Group chat with PM, DevOps, and CTO – practice cloud migration decisions")
 
+    # Candidate label from the sidebar user ID, computed once per rerun for every bubble
+    user_id = st.session_state.get("user_id_input", "").strip()
+    is_valid_name = bool(user_id) and user_id != "default_user"
+    st.session_state["_render_ctx"] = (user_id, is_valid_name, user_id if is_valid_name else "Candidate")
+
     simulation = init_session()
     render_chat()
 
     if prompt := st.chat_input("Write your response..."):
         st.session_state.messages.append({"role": "user", "content": prompt})
-        
-        # Check if we have a valid custom name
-        user_id = st.session_state.get("user_id_input", "").strip()
-        is_valid_name = user_id and user_id != "default_user"
-        display_label = user_id if is_valid_name else "Candidate"
-        
-        with st.chat_message(display_label, avatar="🧑"):
-            # Conditional header based on name existence
-            if is_valid_name:
-                st.caption(f"**Name:** {user_id}  \n**Role:** Candidate")
-            else:
-                st.caption(f"**Role:** Candidate")
-            st.markdown(prompt)
+        _render_user_bubble(prompt, st.session_state["_render_ctx"])
 
         with st.spinner("Waiting for team response..."):
+            # Show persona tokens as they arrive; replaced by the full bubble below
+            stream_box = st.empty()
+            streamed = []
+
+            def _on_token(text: str) -> None:
+                streamed.append(text)
+                stream_box.markdown("".join(streamed))
+
             try:
                 # Process simulation logic
-                agent_response, should_end = simulation.process_user_input(prompt)
+                agent_response, should_end = simulation.process_user_input(prompt, on_token=_on_token)
             except Exception as e:
                 st.error(f"Error: {e}")
                 agent_response = None
                 should_end = False
+            stream_box.empty()
 
         if agent_response:
             # Store and display the agent's response
-            st.session_state.messages.append({"role": "agent", "content": agent_response})
-            speaker, body = _parse_agent_message(agent_response)
-            display_name, role_label, avatar = _speaker_to_display(speaker)
-            label = _persona_label(display_name, role_label)
-            
-            with st.chat_message(label, avatar=avatar):
-                if role_label and speaker != "Scenario":
-                    st.caption(f"**Name:** {display_name}  \n**Role:** {role_label}")
-                st.markdown(body)
-
-            # Rerun so sidebar updates immediately with the new persona
-            if not should_end:
-                st.rerun()
+            agent_msg = _agent_message(agent_response)
+            st.session_state.messages.append(agent_msg)
+            _render_agent_bubble(agent_msg)
 
         if should_end:
             st.session_state.simulation_ended = True
@@ -268,9 +283,10 @@ def main():
         else:
             st.error("❌ **Result: Try again.** Focus on strategy, constraints, and stakeholder input in the next run.")
         if st.button("Start new simulation", key="start_new_simulation"):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            st.session_state.clear()
             st.rerun()
 
+    render_sidebar()
+
 if __name__ == "__main__":
     main()
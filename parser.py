@@ -1,25 +1,45 @@
 """User response parsing using LLM API."""
 
 import json
+import re
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Any
 
 from config import LLMConfig
+from response_cache import response_cache, make_cache_key
+
+# orjson is optional; its decode errors subclass ValueError like json's
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 # Canonical constraint names used everywhere (evaluation, state, UI)
 VALID_CONSTRAINTS = {"time", "cost", "security", "perf", "downtime", "partial_docs"}
 
+# JSON body of an LLM reply, with optional ```json ... ``` fences and surrounding whitespace dropped
+_JSON_FENCE_RE = re.compile(r"^\s*(?:```(?:json)?\s*)?(.*?)(?:\s*```)?\s*$", re.DOTALL)
+
+# The reply schema is under 100 tokens; a tight cap ends the request as soon as the object closes
+PARSE_MAX_TOKENS = 128
+
+# Parsed results kept per parser, keyed on the normalized message
+PARSE_CACHE_SIZE = 256
+
+# Short replies (fewer than 3 words) made only of these carry no strategy or constraint
+_NON_INFORMATIVE_WORDS = {
+    "ok", "okay", "yes", "no", "sure", "thanks", "thank", "you", "got", "it",
+    "agreed", "fine", "hi", "hello", "hmm", "right", "understood",
+}
+
 
 def _normalize_constraints(raw: Any) -> List[str]:
-    """Normalize constraint list: lowercase, filter to valid names only."""
-    if not raw:
+    """Normalize constraint list: lowercase, filter to valid names only (duplicates dropped)."""
+    if not raw or not isinstance(raw, list):
         return []
-    result = []
-    for c in raw if isinstance(raw, list) else []:
-        if isinstance(c, str):
-            key = c.strip().lower()
-            if key in VALID_CONSTRAINTS:
-                result.append(key)
-    return result
+    return list({c.strip().lower() for c in raw if isinstance(c, str)} & VALID_CONSTRAINTS)
 
 
 class UserResponseParser:
@@ -29,34 +49,39 @@ class UserResponseParser:
         """Initialize parser with LLM configuration."""
         self.llm_config = llm_config
         self._client = None
+        self._parse_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # One parser may serve several sessions' threads; the lock covers cache bookkeeping only
+        self._cache_lock = threading.Lock()
     
     def _get_client(self):
         """Get LLM client (lazy initialization)."""
         if self._client is None:
-            if self.llm_config.provider == "openai":
-                try:
-                    import openai
-                    self._client = openai.OpenAI(api_key=self.llm_config.api_key)
-                except ImportError:
-                    raise ImportError("openai package not installed. Run: pip install openai")
-            elif self.llm_config.provider == "anthropic":
-                try:
-                    import anthropic
-                    self._client = anthropic.Anthropic(api_key=self.llm_config.api_key)
-                except ImportError:
-                    raise ImportError("anthropic package not installed. Run: pip install anthropic")
-            else:
-                raise ValueError(f"Unsupported LLM provider: {self.llm_config.provider}")
+            self._client = self.llm_config.get_client()
         return self._client
     
     def parse_user_response(self, user_message: str) -> Dict[str, Any]:
         """Parse user message to extract strategy, constraints, and confidence. Requires LLM; no fallback."""
-        return self._parse_with_llm(user_message)
+        key = " ".join(user_message.lower().split())
+        with self._cache_lock:
+            result = self._parse_cache.get(key)
+            if result is not None:
+                self._parse_cache.move_to_end(key)
+        if result is None:
+            words = [w.strip(".,!?") for w in key.split()]
+            if len(words) < 3 and all(w in _NON_INFORMATIVE_WORDS or not w for w in words):
+                # Acknowledgements like "ok thanks" never need an LLM round-trip
+                result = {"strategy": None, "constraints": [], "confidence": None}
+            else:
+                result = self._parse_with_llm(user_message)
+            with self._cache_lock:
+                self._parse_cache[key] = result
+                if len(self._parse_cache) > PARSE_CACHE_SIZE:
+                    self._parse_cache.popitem(last=False)
+        # Callers keep the result on State, so hand out a copy
+        return dict(result, constraints=list(result["constraints"]))
     
     def _parse_with_llm(self, user_message: str) -> Dict[str, Any]:
         """Parse using LLM API."""
-        client = self._get_client()
-        
         prompt = f"""Analyze the following user message about cloud migration and extract structured information.
 
 User message: "{user_message}"
@@ -76,39 +101,52 @@ Return ONLY a JSON object with this structure (use the key "constraints" in lowe
 JSON:"""
         
         if self.llm_config.provider == "openai":
-            response = client.chat.completions.create(
-                model=self.llm_config.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that extracts structured information from text. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.llm_config.temperature,
-                max_tokens=self.llm_config.max_tokens
-            )
-            content = response.choices[0].message.content.strip()
+            messages = [
+                {"role": "system", "content": "You are a helpful assistant that extracts structured information from text. Always respond with valid JSON only."},
+                {"role": "user", "content": prompt}
+            ]
         else:  # anthropic
-            response = client.messages.create(
-                model=self.llm_config.model,
-                max_tokens=self.llm_config.max_tokens,
-                temperature=self.llm_config.temperature,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            content = response.content[0].text.strip()
+            messages = [
+                {"role": "user", "content": prompt}
+            ]
+        max_tokens = min(self.llm_config.max_tokens, PARSE_MAX_TOKENS)
+        cache_key = make_cache_key(
+            self.llm_config.provider, self.llm_config.model, messages,
+            self.llm_config.temperature, max_tokens
+        )
+        content = response_cache.get(cache_key)
+        cache_miss = content is None
+
+        if cache_miss:
+            client = self._get_client()
+            if self.llm_config.provider == "openai":
+                response = client.chat.completions.create(
+                    model=self.llm_config.model,
+                    messages=messages,
+                    temperature=self.llm_config.temperature,
+                    max_tokens=max_tokens,
+                    response_format={"type": "json_object"}
+                )
+                content = response.choices[0].message.content
+            else:  # anthropic
+                response = client.messages.create(
+                    model=self.llm_config.model,
+                    max_tokens=max_tokens,
+                    temperature=self.llm_config.temperature,
+                    system="Return ONLY a JSON object.",
+                    messages=messages
+                )
+                content = response.content[0].text
         
         # Extract JSON from response
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        match = _JSON_FENCE_RE.match(content)
+        content = match.group(1) if match else content.strip()
         
         try:
-            result = json.loads(content)
+            result = _loads(content)
+            if cache_miss:
+                # Only cache replies that parsed, so a bad reply is retried next time
+                response_cache.set(cache_key, content)
             # Accept "constraints" or "Constraints" (some LLMs vary)
             raw_constraints = result.get("constraints") or result.get("Constraints") or []
             constraints = _normalize_constraints(raw_constraints)
@@ -117,5 +155,5 @@ JSON:"""
                 "constraints": constraints,
                 "confidence": result.get("confidence")
             }
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             raise ValueError(f"LLM returned invalid JSON: {e}") from e
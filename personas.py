@@ -1,9 +1,316 @@
 """Persona system for simulation interactions."""
 
+import functools
+import logging
 import random
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Tuple, Any
 
 from config import LLMConfig
+from response_cache import response_cache, make_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Replies are capped at 70 words (~100 tokens) by the style rules; this leaves headroom without
+# letting a runaway reply bill the full LLMConfig.max_tokens
+PERSONA_MAX_TOKENS = 200
+
+# --- Prompt text shared by every persona reply (built once at import) ---
+
+# Base rules for ALL personas (pressure + realism)
+_BASE_RULES = """
+        Global rules (apply to ALL personas):
+        - Do NOT give generic advice. Ground your response strictly in the provided context and the constraints surfaced this round.
+        - If the user's plan lacks clarity or contains risk, ask up to 2-3 pointed follow-up questions that require concrete specifics (numbers, ownership, thresholds, assumptions).
+        - Reference relevant concrete facts from the context (e.g., deadline, budget, SLO, dependency, selected strategy) when they materially impact the discussion.
+        - Challenge assumptions only when they affect cost, reliability, timeline, security, or operational risk.
+        - Always drive the conversation toward a decision, trade-off, or clarification.
+        - End with one clear next action that moves the plan forward.
+        - You may only reference the “Active constraints” listed in the prompt. Do not introduce or imply additional constraints.
+        - If an "Information gap" is present, ask for it before giving a detailed plan.
+        - If an Information gap blocks cost or reliability validation, you must pause approval until it is clarified.
+        - Do not introduce new services or dependencies that are not mentioned in the context.
+
+
+        Output style and constraints:
+        - Maximum 70 words.
+        - Use clear, simple English.
+        - Write in a natural conversational tone aligned with the persona (CTO, PM, DevOps, etc.).
+        - Use 1–2 short paragraphs OR up to 3 short bullet-style lines (not both).
+        - Integrate follow-up questions smoothly (do not make them feel like a checklist).
+        - Avoid long explanations. Be direct and concrete.
+        - End with a clear forward-driving sentence that naturally states what must happen next, without labeling it explicitly.
+                """
+
+# Style + role focus (different "voice" per persona), keyed by lowercased role
+_STYLE_BY_ROLE = {
+    "cto": """
+    Style:
+    - Very concise, executive tone. Slightly stressful but professional.
+    - No long explanations. Prefer short sentences and direct questions.
+    """,
+    "product manager": """
+    Style:
+    - Crisp and pragmatic. Customer/stakeholder oriented. Slight urgency.
+    - Push for clarity and prioritization; avoid technical deep-dives unless needed.
+    """,
+    "devops engineer": """
+    Style:
+    - Technical and risk-aware. Calm but firm.
+    - Uses operational language (runbook, blast radius, staging, observability).
+    """,
+    "_default": """
+    Style:
+    - Professional and direct.
+    """,
+}
+
+_ROLE_FOCUS_BY_ROLE = {
+    "cto": """
+    CTO focus:
+    - Force a trade-off decision (what you will sacrifice to meet constraints).
+    - Demand ownership and rollback: who is on-call, cutover/rollback trigger.
+    - Push on cost and long-term maintainability; ask for KPI tracking.
+    - If rollback/timeline/cost are missing, block approval explicitly.
+    """,
+    "product manager": """
+    PM focus:
+    - Push on scope, milestones, and customer impact.
+    - Force prioritization: what will NOT ship now.
+    - Ask for a weekly plan (milestones) and stakeholder communication plan.
+    - If timeline is unclear, request a phased plan with dates/milestones.
+    """,
+    "devops engineer": """
+    DevOps focus:
+    - Push on deployment safety, IAM mapping, observability, CI/CD, and incident response.
+    - Require a runbook: monitoring, alerting, rollback steps.
+    - Ask about testing/staging strategy and minimizing blast radius.
+    - If security/downtime is not addressed, escalate the risk.
+    """,
+    "_default": """
+    Role focus:
+    - Ask for assumptions, risks, and measurable next steps relevant to your role.
+    """,
+}
+
+# Extra instructions by risk band: "high" (risk >= 75), "elevated" (>= 50), "none"
+_ESCALATION_BY_BAND = {
+    "high": (
+        "Risk level is very high. Be firm and urgent. Do not approve a cutover plan until the user provides "
+        "clear owners, concrete rollback triggers, and measurable thresholds. Keep the tone professional and forward-moving."
+    ),
+    "elevated": "Risk level is elevated. Ask for concrete numbers and owners, and push for clear trade-offs and KPIs.",
+    "none": "",
+}
+
+
+# Persona-specific complications (PMPersona / DevOpsPersona / CTOPersona.generate_complication)
+_PM_COMPLICATIONS: tuple[str, ...] = (
+    "Deadline shortened: we must ship in 10 days. No full refactor is possible.",
+    "Stakeholders want to see progress this week. Can we show something working quickly?",
+    "The scope has changed - we need to support 3x more users than originally planned.",
+    "Upper management is asking for daily updates. We need a clear migration timeline.",
+    "Customer commitments require zero disruption. How do we ensure smooth transition?",
+)
+
+_DEVOPS_COMPLICATIONS: tuple[str, ...] = (
+    "Access model changes: IAM roles need to map to Azure RBAC. We must pass security review before deployment.",
+    "Infrastructure as Code needs to be rewritten. Our Terraform modules are AWS-specific.",
+    "Monitoring and logging systems are different. We need a migration plan for observability.",
+    "CI/CD pipelines depend on AWS-specific services. We'll need to rebuild them.",
+    "Network security groups and VPC configurations don't translate directly. This affects our architecture.",
+)
+
+_CTO_COMPLICATIONS: tuple[str, ...] = (
+    "Cost cap added: we have a strict budget. Egress costs and new managed services need careful evaluation.",
+    "Long-term strategy: we're considering multi-cloud. How does this migration fit our 5-year plan?",
+    "Vendor lock-in is a concern. We want to avoid being tied to one provider's proprietary features.",
+    "Team expertise: our engineers know AWS well. Training costs and time for new cloud provider need consideration.",
+    "Compliance requirements: we need to ensure the new provider meets all regulatory standards.",
+)
+
+# Key of the information gap chosen once per session
+_INFO_GAP_KEYS: tuple[str, ...] = ("baseline_cost", "peak_load", "downtime_budget", "slo_target")
+
+# Hidden constraint revealed once on round 2 and reused afterwards
+_HIDDEN_POOL: tuple[str, ...] = (
+    "New info: The nightly batch job runs with ConsistentRead=True on the DynamoDB table using partition key 'user_id'. Any migration that switches to eventual consistency or changes the partition key will cause incorrect financial aggregates.",
+    "New info: The security team requires CloudTrail-equivalent audit logs for all read/write operations and documented key rotation policy (every 90 days) before approving any production cutover.",
+    "New info: A legacy internal service assumes the IAM role name 'user-data-prod-role' and parses it explicitly in its configuration. Renaming or restructuring IAM roles will cause authentication failures in production.",
+    "New info: A downstream analytics pipeline expects DynamoDB items to always include the attributes 'user_id', 'account_status', and 'created_at'. Removing or renaming any of these fields will break ETL ingestion jobs.",
+)
+
+# Information gap chosen once per session
+_GAP_OPTIONS: tuple[str, ...] = (
+    "Information gap: we do NOT have the current AWS monthly cost baseline yet.",
+    "Information gap: we do NOT have peak load numbers (RCU/WCU/RPS) yet.",
+    "Information gap: the downtime budget is not confirmed yet.",
+    "Information gap: Do NOT assume any SLO number (99.9/99.95/etc.) until it is confirmed.",
+)
+
+# Organizational politics chosen once per session
+_ORG_PRESSURES: tuple[str, ...] = (
+    "Organizational pressure: The CFO has publicly committed to a 30% cost reduction this quarter.",
+    "Organizational pressure: The Security Director has warned that no migration will be approved without full audit evidence.",
+    "Organizational pressure: The VP Engineering prefers a rewrite instead of lift-and-shift.",
+    "Organizational pressure: Product is concerned about customer churn if downtime exceeds expectations.",
+)
+
+# Company-chaos twists for generate_complication (every 2nd round)
+_TWISTS: tuple[str, ...] = (
+    "New info: Security blocks new deployments this week unless risk is low.",
+    "Incident: a production alert fired; leadership wants zero risky changes for 48 hours.",
+    "Customer pressure: enterprise client reports latency regression; +10ms max allowed.",
+    "Hidden dependency discovered: a legacy service calls AWS SDK directly with no tests.",
+)
+
+
+_MISSING = object()
+
+# State fields _respond_with_llm only reads; the per-session persona context it writes
+# (info gap, org pressure, hidden constraint) is accessed on the state itself
+_SNAPSHOT_FIELDS = (
+    "scenario_variant", "strategy_selected", "constraints_addressed", "weeks_left", "budget_level",
+    "downtime_budget_minutes", "slo_availability", "target_cost_reduction_pct", "critical_dependencies",
+    "user_id", "round_count", "missing_deliverables", "risk_score", "last_constraints_shown",
+)
+
+
+def _state_snapshot(state: Any) -> Dict[str, Any]:
+    """Read the fields in _SNAPSHOT_FIELDS once (works for slotted and plain state objects)."""
+    snapshot = {}
+    for name in _SNAPSHOT_FIELDS:
+        value = getattr(state, name, _MISSING)
+        if value is not _MISSING:
+            snapshot[name] = value
+    return snapshot
+
+
+def _shared_prefix(state: Any, s: Dict[str, Any]) -> str:
+    """
+    System-prompt prefix shared by all personas: the session's AWS services plus the global rules.
+    Memoized on state (keyed by the facts) so it is built once per session.
+    Company constraints (deadline, budget, SLO, ...) are not repeated here; the ones that matter this
+    round reach the persona only as "Active constraints" in the user prompt.
+    """
+    facts: List[str] = []
+    if s.get("scenario_variant"):
+        services = ", ".join(s["scenario_variant"].get("services", []))
+        if services:
+            facts.append(f"The migration involves AWS services: {services}")
+
+    key = tuple(facts)
+    cached = getattr(state, "_shared_prefix_cache", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    parts = ["You are participating in a realistic cloud-migration simulation as one of the project's stakeholders."]
+    if facts:
+        parts.append("Project facts:")
+        parts.extend(f"- {fact}" for fact in facts)
+    parts.append(_BASE_RULES)
+    prefix = "\n".join(parts)
+    try:
+        state._shared_prefix_cache = (key, prefix)
+    except AttributeError:
+        pass
+    return prefix
+
+
+def _rng(state: Any) -> random.Random:
+    """Per-session RNG for persona picks, seeded from the session id so a session's draws are reproducible."""
+    rng = getattr(state, "_rng", None)
+    if rng is None:
+        rng = random.Random(getattr(state, "session_id", None) or getattr(state, "user_id", "user"))
+        try:
+            state._rng = rng
+        except AttributeError:
+            pass
+    return rng
+
+
+# Context lines dropped (in this order) when a prompt exceeds LLMConfig.max_prompt_tokens
+_TRIM_ORDER = (
+    "Constraints already discussed:",
+    "Missing deliverables from user plan:",
+    "Current risk score",
+    "The team is considering:",
+)
+
+# Unbounded context lines shortened (in this order) when dropping _TRIM_ORDER is not enough
+_TRUNCATE_ORDER = ("User's latest message: ", "Current situation: ")
+_TRUNCATED_MARK = " …[truncated]"
+
+
+@functools.lru_cache(maxsize=8)
+def _token_encoder(model: str) -> Any:
+    """
+    tiktoken encoding for model, or None if tiktoken is unavailable (optional dependency).
+    Any failure, e.g. the first-use BPE download on an offline host, also gives None.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("tiktoken encoding unavailable; estimating prompt tokens from length", exc_info=True)
+        return None
+
+
+def _estimate_tokens(text: str, model: str, budget: int) -> int:
+    """
+    Token count for text, exact only when it could matter: ~4 characters per token unless that
+    estimate reaches half the budget (dense text can run ~2 characters per token), then tiktoken
+    (cl100k_base for models it doesn't know) if available.
+    """
+    rough = len(text) // 4
+    if rough < budget // 2:
+        return rough
+    encoder = _token_encoder(model)
+    if encoder is None:
+        return rough
+    return len(encoder.encode(text))
+
+
+def _persona_system_suffix(name: str, role: str) -> str:
+    """System-prompt text that follows the shared prefix: persona identity, style and role focus."""
+    key = (role or "").lower()
+    style = _STYLE_BY_ROLE.get(key, _STYLE_BY_ROLE["_default"])
+    role_focus = _ROLE_FOCUS_BY_ROLE.get(key, _ROLE_FOCUS_BY_ROLE["_default"])
+    return f"""
+    You are {name}, a {role}. Follow the global rules above (company constraints come only from the Active constraints), the user's provided context, and the style below.
+    {style}
+    {role_focus}
+    """
+
+
+def _ensure_random_field(state: Any, attr: str, pool: Tuple[str, ...]) -> str:
+    """Return state.<attr>, first drawing it from pool with the session RNG if it is not set yet."""
+    value = getattr(state, attr, None)
+    if not value:
+        value = _rng(state).choice(pool)
+        setattr(state, attr, value)
+    return value
+
+
+def _user_seed(state: Any) -> int:
+    """hash(user_id), computed once and kept on the state for dependency/twist rotation."""
+    seed = getattr(state, "_user_id_hash", None)
+    if seed is None:
+        seed = hash(getattr(state, "user_id", "user"))
+        try:
+            state._user_id_hash = seed
+        except AttributeError:
+            pass
+    return seed
+
+
+def _anthropic_system(system_prompt: str) -> List[Dict[str, Any]]:
+    """Anthropic system blocks with the stable prompt marked for prompt caching."""
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
 
 
 class Persona:
@@ -15,108 +322,82 @@ class Persona:
         self.role = role
         self.llm_config = llm_config
         self._client = None
+        # Role-specific prompt text never changes for a persona, so it is built once here
+        self._system_suffix = _persona_system_suffix(name, role)
+        self._respond_line = f"Respond as {name} ({role}). Be professional and realistic."
     
     def _get_client(self):
         """Get LLM client (lazy initialization)."""
         if self._client is None:
-            if self.llm_config.provider == "openai":
-                try:
-                    import openai
-                    self._client = openai.OpenAI(api_key=self.llm_config.api_key)
-                except ImportError:
-                    raise ImportError("openai package not installed. Run: pip install openai")
-            elif self.llm_config.provider == "anthropic":
-                try:
-                    import anthropic
-                    self._client = anthropic.Anthropic(api_key=self.llm_config.api_key)
-                except ImportError:
-                    raise ImportError("anthropic package not installed. Run: pip install anthropic")
-            else:
-                raise ValueError(f"Unsupported LLM provider: {self.llm_config.provider}")
+            self._client = self.llm_config.get_client()
         return self._client
+
+    def _get_async_client(self):
+        """Get the async LLM client for the running event loop (not kept on the persona, which outlives loops)."""
+        return self.llm_config.get_async_client()
     
     def generate_complication(self, state: Any) -> str:
         """Generate a complication for this persona."""
         raise NotImplementedError
     
-    def respond_as_persona(self, complication: str, state: Any, user_message: Optional[str] = None) -> str:
-        """Generate a response as this persona. Requires LLM; no fallback."""
-        return self._respond_with_llm(complication, state, user_message)
-    
-    def _respond_with_llm(self, complication: str, state: Any, user_message: Optional[str] = None) -> str:
-        """Generate response using LLM."""
-        client = self._get_client()
+    def respond_as_persona(
+        self,
+        complication: str,
+        state: Any,
+        user_message: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Generate a response as this persona. Requires LLM; no fallback.
+        If on_token is given, the reply is streamed and each text chunk is passed to it as it arrives.
+        """
+        return self._respond_with_llm(complication, state, user_message, on_token)
 
-        # Build context (include more "company realism" if available in state)
-        context_parts = [
-            f"You are a {self.role} ({self.name}) in a cloud migration project.",
-            f"Current situation: {complication}",
-        ]
+    async def respond_as_persona_async(
+        self, complication: str, state: Any, user_message: Optional[str] = None
+    ) -> str:
+        """Async variant of respond_as_persona (no streaming); awaits the provider's async client."""
+        return await self._respond_with_llm_async(complication, state, user_message)
+
+    def _build_messages(self, complication: str, state: Any, user_message: Optional[str]) -> List[Dict[str, str]]:
+        """Build the [system, user] messages for one reply (picks and stores per-session context on state)."""
+        s = _state_snapshot(state)
+        seed = _user_seed(state)
+
+        # Build context (include more "company realism" if available in state).
+        # Lines that change least come first and the per-turn ones last, so consecutive
+        # prompts share the longest possible prefix for provider-side prompt caching.
+        # (Persona identity is stated once, in the system prompt.)
+        context_parts: List[str] = []
+
+        if s.get("strategy_selected"):
+            context_parts.append(f"The team is considering: {s['strategy_selected']} strategy")
+
+        if s.get("constraints_addressed"):
+            context_parts.append(f"Constraints already discussed: {state.constraints_text()}")
 
-        if getattr(state, "scenario_variant", None):
-            services = ", ".join(state.scenario_variant.get("services", []))
-            if services:
-                context_parts.append(f"The migration involves AWS services: {services}")
-
-        if getattr(state, "strategy_selected", None):
-            context_parts.append(f"The team is considering: {state.strategy_selected} strategy")
-
-        if getattr(state, "constraints_addressed", None):
-            constraints = ", ".join(state.constraints_addressed)
-            if constraints:
-                context_parts.append(f"Constraints already discussed: {constraints}")
-
-        if not getattr(state, "info_gap_key", None):
-             state.info_gap_key = random.choice(["baseline_cost", "peak_load", "downtime_budget", "slo_target"])
-
-        # Optional realism fields (only if you added them to State)
-        if hasattr(state, "weeks_left"):
-            context_parts.append(f"Company constraint: {state.weeks_left} weeks left.")
-        if hasattr(state, "budget_level"):
-            context_parts.append(f"Company constraint: budget level is {state.budget_level}.")
-        if hasattr(state, "downtime_budget_minutes"):
-            context_parts.append(f"Company constraint: downtime budget is {state.downtime_budget_minutes} minutes.")
-        if hasattr(state, "slo_availability"):
-            context_parts.append(f"Company constraint: SLO availability target is {state.slo_availability}.")
-        if hasattr(state, "target_cost_reduction_pct"):
-            context_parts.append(f"Company constraint: target cost reduction is {state.target_cost_reduction_pct}%.")
-
-        deps = getattr(state, "critical_dependencies", None)
-        if deps:
-            # Include 0-1 dependency to keep it readable
-            idx = (hash(getattr(state, "user_id", "user")) + getattr(state, "round_count", 0)) % len(deps)
-            context_parts.append(f"Known dependency: {deps[idx]}")
-
-        missing = getattr(state, "missing_deliverables", None)
+        _ensure_random_field(state, "info_gap_key", _INFO_GAP_KEYS)
+
+        missing = s.get("missing_deliverables")
         if missing:
             missing_list = ", ".join(sorted(list(missing)))
             context_parts.append(f"Missing deliverables from user plan: {missing_list}")
 
-        risk_score = getattr(state, "risk_score", None)
+        risk_score = s.get("risk_score")
         if risk_score is not None:
             context_parts.append(f"Current risk score (0-100): {risk_score}")
 
+        context_parts.append(f"Current situation: {complication}")
+
         if user_message:
             context_parts.append(f"User's latest message: {user_message}")
 
         # Reveal ONE hidden constraint only on round 2, then keep reusing it
-        rc = getattr(state, "round_count", 0)
-
-        hidden_pool = [
-            "New info: The nightly batch job runs with ConsistentRead=True on the DynamoDB table using partition key 'user_id'. Any migration that switches to eventual consistency or changes the partition key will cause incorrect financial aggregates.",
-            "New info: The security team requires CloudTrail-equivalent audit logs for all read/write operations and documented key rotation policy (every 90 days) before approving any production cutover.",
-            "New info: A legacy internal service assumes the IAM role name 'user-data-prod-role' and parses it explicitly in its configuration. Renaming or restructuring IAM roles will cause authentication failures in production.",
-            "New info: A downstream analytics pipeline expects DynamoDB items to always include the attributes 'user_id', 'account_status', and 'created_at'. Removing or renaming any of these fields will break ETL ingestion jobs.",
-        ]
+        rc = s.get("round_count", 0)
 
         # Pick and store the hidden constraint only once (round 2)
-        if rc == 2 and not getattr(state, "selected_hidden_constraint", None):
-            state.selected_hidden_constraint = random.choice(hidden_pool)
-
-        # Surface it from round 2 onward (same one), so the conversation can develop it
-        if rc >= 2 and getattr(state, "selected_hidden_constraint", None):
-            context_parts.append(state.selected_hidden_constraint)
-
+        if rc == 2:
+            _ensure_random_field(state, "selected_hidden_constraint", _HIDDEN_POOL)
 
         # --- Company constraints: choose 1 (max 2) based on user's answer/state ---
         def _pick_company_constraints(state: Any) -> List[str]:
@@ -124,33 +405,33 @@ class Persona:
             Picks 1-2 constraints to surface this round, tied to what the user missed / chose.
             Uses state.missing_deliverables + strategy_selected + constraints_addressed.
             """
-            missing = set(getattr(state, "missing_deliverables", set()) or [])
-            addressed = set(getattr(state, "constraints_addressed", set()) or [])
-            strategy = (getattr(state, "strategy_selected", None) or "").lower()
+            missing = s.get("missing_deliverables") or frozenset()
+            addressed = s.get("constraints_addressed") or frozenset()
+            strategy = (s.get("strategy_selected") or "").lower()
 
             # Candidate constraints with tags (so we can choose based on missing/strategy)
             candidates = []
 
             # timeline / time pressure
-            if hasattr(state, "weeks_left"):
-                candidates.append(("timeline", f"{state.weeks_left} weeks left until the deadline."))
+            if "weeks_left" in s:
+                candidates.append(("timeline", f"{s['weeks_left']} weeks left until the deadline."))
 
             # cost / budget
-            if hasattr(state, "budget_level"):
-                candidates.append(("budget", f"Budget level is {state.budget_level}."))
-            if hasattr(state, "target_cost_reduction_pct"):
-                candidates.append(("cost_target", f"Cost reduction target is {state.target_cost_reduction_pct}%."))
+            if "budget_level" in s:
+                candidates.append(("budget", f"Budget level is {s['budget_level']}."))
+            if "target_cost_reduction_pct" in s:
+                candidates.append(("cost_target", f"Cost reduction target is {s['target_cost_reduction_pct']}%."))
 
             # reliability
-            if hasattr(state, "downtime_budget_minutes"):
-                candidates.append(("downtime", f"Downtime budget is {state.downtime_budget_minutes} minutes."))
-            if hasattr(state, "slo_availability"):
-                candidates.append(("slo", f"SLO availability target is {state.slo_availability}."))
+            if "downtime_budget_minutes" in s:
+                candidates.append(("downtime", f"Downtime budget is {s['downtime_budget_minutes']} minutes."))
+            if "slo_availability" in s:
+                candidates.append(("slo", f"SLO availability target is {s['slo_availability']}."))
 
             # dependencies (very realistic, but show sparingly)
-            deps = getattr(state, "critical_dependencies", None)
+            deps = s.get("critical_dependencies")
             if deps:
-                idx = (hash(getattr(state, "user_id", "user")) + getattr(state, "round_count", 0)) % len(deps)
+                idx = (seed + s.get("round_count", 0)) % len(deps)
                 candidates.append(("dependency", f"Known dependency: {deps[idx]}"))
 
             # --- Priority rules: tie to user's answer ---
@@ -181,7 +462,7 @@ class Persona:
                 priority_tags += ["dependency", "downtime"]
 
             # Avoid repeating the exact same constraint every round (simple memory)
-            last_tags = set(getattr(state, "last_constraints_shown", set()) or [])
+            last_tags = s.get("last_constraints_shown") or frozenset()
 
             # Score candidates: higher score => more likely to show
             scored = []
@@ -198,16 +479,11 @@ class Persona:
                     score -= 1
                 scored.append((score, tag, text))
 
-            scored.sort(reverse=True)  # highest score first
-            
-
-            # Pick the top candidate first
+            # Pick the top candidate first (single max() pass; only one item is needed, so no sort)
             chosen = []
-            for score, tag, text in scored:
-                if score < 0:
-                    continue
-                chosen.append((tag, text))
-                break
+            best = max(scored, default=None)
+            if best is not None and best[0] >= 0:
+                chosen.append((best[1], best[2]))
 
             # Try to add a second constraint that creates a "tension" with the first one
             conflict_map = {
@@ -231,7 +507,7 @@ class Persona:
                     ]
 
                     if conflict_candidates:
-                        tag, text = random.choice(conflict_candidates)
+                        tag, text = _rng(state).choice(conflict_candidates)
                         chosen.append((tag, text))
 
 
@@ -263,190 +539,208 @@ class Persona:
             elif getattr(state, "org_pressure_text", None):
                 extra = state.org_pressure_text
 
-        if extra:
-            context_parts.append(extra)
-            if extra not in picked_constraints:
-                picked_constraints.append(extra)
-
+        if extra and extra not in picked_constraints:
+            picked_constraints.append(extra)
 
         # Hard cap: max 2 active constraints
         picked_constraints = picked_constraints[:2]
 
-        for c in picked_constraints[:2]:
-            context_parts.append(f"Company constraint (relevant now): {c}")
+        # Surface the hidden constraint from round 2 onward (same one), so the conversation can develop it
+        hidden = getattr(state, "selected_hidden_constraint", None)
+        if rc >= 2 and hidden and hidden not in picked_constraints:
+            picked_constraints.append(hidden)
 
-        # Add hidden constraint as active constraint if exists
-        if rc >= 2 and getattr(state, "selected_hidden_constraint", None):
-            picked_constraints.append(state.selected_hidden_constraint)
 
-
-        if not getattr(state, "info_gap_text", None):
-            gap_options = [
-                "Information gap: we do NOT have the current AWS monthly cost baseline yet.",
-                "Information gap: we do NOT have peak load numbers (RCU/WCU/RPS) yet.",
-                "Information gap: the downtime budget is not confirmed yet.",
-                "Information gap: Do NOT assume any SLO number (99.9/99.95/etc.) until it is confirmed.",
-            ]
-            state.info_gap_text = random.choice(gap_options)
-
-        # Show it in context AND in active constraints so the persona must address it
-        context_parts.append(state.info_gap_text)
-        if state.info_gap_text not in picked_constraints:
-            picked_constraints.append(state.info_gap_text)
+        # Always an active constraint so the persona must address it
+        info_gap_text = _ensure_random_field(state, "info_gap_text", _GAP_OPTIONS)
+        if info_gap_text not in picked_constraints:
+            picked_constraints.append(info_gap_text)
 
         
         # Add organizational politics 
-        if not getattr(state, "org_pressure_text", None):
-            org_pressures = [
-                "Organizational pressure: The CFO has publicly committed to a 30% cost reduction this quarter.",
-                "Organizational pressure: The Security Director has warned that no migration will be approved without full audit evidence.",
-                "Organizational pressure: The VP Engineering prefers a rewrite instead of lift-and-shift.",
-                "Organizational pressure: Product is concerned about customer churn if downtime exceeds expectations.",
-            ]
-            state.org_pressure_text = random.choice(org_pressures)
-
-        context_parts.append(state.org_pressure_text)
-        picked_constraints.append(state.org_pressure_text)
+        org_pressure_text = _ensure_random_field(state, "org_pressure_text", _ORG_PRESSURES)
+        if org_pressure_text not in picked_constraints:
+            picked_constraints.append(org_pressure_text)
 
 
-        context = "\n".join(context_parts)
-
-        # --- Base rules for ALL personas (pressure + realism) ---
-        base_rules = """
-        Global rules (apply to ALL personas):
-        - Do NOT give generic advice. Ground your response strictly in the provided context and the constraints surfaced this round.
-        - If the user's plan lacks clarity or contains risk, ask up to 2-3 pointed follow-up questions that require concrete specifics (numbers, ownership, thresholds, assumptions).
-        - Reference relevant concrete facts from the context (e.g., deadline, budget, SLO, dependency, selected strategy) when they materially impact the discussion.
-        - Challenge assumptions only when they affect cost, reliability, timeline, security, or operational risk.
-        - Always drive the conversation toward a decision, trade-off, or clarification.
-        - End with one clear next action that moves the plan forward.
-        - You may only reference the “Active constraints” listed below. Do not introduce or imply additional constraints.
-        - If an "Information gap" is present, ask for it before giving a detailed plan.
-        - If an Information gap blocks cost or reliability validation, you must pause approval until it is clarified.
-        - Do not introduce new services or dependencies that are not mentioned in the context.
+        if risk_score is None:
+            band = "none"
+        else:
+            band = "high" if risk_score >= 75 else "elevated" if risk_score >= 50 else "none"
+        escalation_note = _ESCALATION_BY_BAND[band]
 
+        active_constraints = picked_constraints or []
 
-        Output style and constraints:
-        - Maximum 70 words.
-        - Use clear, simple English.
-        - Write in a natural conversational tone aligned with the persona (CTO, PM, DevOps, etc.).
-        - Use 1–2 short paragraphs OR up to 3 short bullet-style lines (not both).
-        - Integrate follow-up questions smoothly (do not make them feel like a checklist).
-        - Avoid long explanations. Be direct and concrete.
-        - End with a clear forward-driving sentence that naturally states what must happen next, without labeling it explicitly.
-                """
+        # Session-wide facts and global rules come first and are identical for every persona,
+        # so all three share one cacheable prefix; the persona's own instructions follow it.
+        system_prompt = _shared_prefix(state, s) + self._system_suffix
+
+        prompt = self._render_user_prompt(context_parts, active_constraints, escalation_note)
+
+        # Over the input budget: drop the lowest-priority context lines until it fits
+        budget = self.llm_config.max_prompt_tokens
+        tokens = _estimate_tokens(system_prompt + prompt, self.llm_config.model, budget)
+        if tokens > budget:
+            for prefix in _TRIM_ORDER:
+                context_parts = [line for line in context_parts if not line.startswith(prefix)]
+                prompt = self._render_user_prompt(context_parts, active_constraints, escalation_note)
+                trimmed = _estimate_tokens(system_prompt + prompt, self.llm_config.model, budget)
+                if trimmed <= budget:
+                    break
+            for prefix in _TRUNCATE_ORDER:
+                while trimmed > budget:
+                    index = next((i for i, line in enumerate(context_parts) if line.startswith(prefix)), None)
+                    if index is None:
+                        break
+                    text = context_parts[index][len(prefix):]
+                    if text.endswith(_TRUNCATED_MARK):
+                        text = text[: -len(_TRUNCATED_MARK)]
+                    # ~4 characters per token; repeat until the exact estimate fits
+                    keep = max(0, len(text) - (trimmed - budget) * 4)
+                    context_parts[index] = prefix + text[:keep] + _TRUNCATED_MARK
+                    prompt = self._render_user_prompt(context_parts, active_constraints, escalation_note)
+                    trimmed = _estimate_tokens(system_prompt + prompt, self.llm_config.model, budget)
+                    if keep == 0:
+                        break
+            if trimmed <= budget:
+                logger.info("Trimmed %s prompt from ~%d to ~%d tokens (budget %d)", self.name, tokens, trimmed, budget)
+            else:
+                logger.warning(
+                    "%s prompt is still ~%d tokens after trimming, over the budget of %d", self.name, trimmed, budget
+                )
 
-        # --- Style + role focus (different "voice" per persona) ---
-        role = (self.role or "").lower()
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
 
-        style = ""
-        role_focus = ""
+    def _render_user_prompt(self, context_parts: List[str], active_constraints: List[str], escalation_note: str) -> str:
+        """User prompt assembled in one join: context, active constraints, reply instruction."""
+        parts: List[str] = [*context_parts, "", "Active constraints this round:"]
+        parts.extend(f"- {c}" for c in active_constraints)
+        parts += ["", self._respond_line]
+        if escalation_note:
+            parts.append(escalation_note)
+        return "\n".join(parts)
 
-        if role == "cto":
-            style = """
-    Style:
-    - Very concise, executive tone. Slightly stressful but professional.
-    - No long explanations. Prefer short sentences and direct questions.
-    """
-            role_focus = """
-    CTO focus:
-    - Force a trade-off decision (what you will sacrifice to meet constraints).
-    - Demand ownership and rollback: who is on-call, cutover/rollback trigger.
-    - Push on cost and long-term maintainability; ask for KPI tracking.
-    - If rollback/timeline/cost are missing, block approval explicitly.
-    """
-        elif role == "product manager":
-            style = """
-    Style:
-    - Crisp and pragmatic. Customer/stakeholder oriented. Slight urgency.
-    - Push for clarity and prioritization; avoid technical deep-dives unless needed.
-    """
-            role_focus = """
-    PM focus:
-    - Push on scope, milestones, and customer impact.
-    - Force prioritization: what will NOT ship now.
-    - Ask for a weekly plan (milestones) and stakeholder communication plan.
-    - If timeline is unclear, request a phased plan with dates/milestones.
-    """
-        elif role == "devops engineer":
-            style = """
-    Style:
-    - Technical and risk-aware. Calm but firm.
-    - Uses operational language (runbook, blast radius, staging, observability).
-    """
-            role_focus = """
-    DevOps focus:
-    - Push on deployment safety, IAM mapping, observability, CI/CD, and incident response.
-    - Require a runbook: monitoring, alerting, rollback steps.
-    - Ask about testing/staging strategy and minimizing blast radius.
-    - If security/downtime is not addressed, escalate the risk.
-    """
-        else:
-            style = """
-    Style:
-    - Professional and direct.
-    """
-            role_focus = """
-    Role focus:
-    - Ask for assumptions, risks, and measurable next steps relevant to your role.
-    """
-       
-        escalation_note = ""
+    def _max_tokens(self) -> int:
+        """Reply cap: the configured max_tokens, but never more than PERSONA_MAX_TOKENS."""
+        return min(self.llm_config.max_tokens, PERSONA_MAX_TOKENS)
 
-        risk_score = getattr(state, "risk_score", None)
-        if risk_score is not None:
-            if risk_score >= 75:
-                escalation_note = """
-        Risk level is very high. Be firm and urgent. Do not approve a cutover plan until the user provides
-        clear owners, concrete rollback triggers, and measurable thresholds. Keep the tone professional and forward-moving.
+    def _cache_key(self, messages: List[Dict[str, str]]) -> Optional[str]:
         """
-            elif risk_score >= 50:
-                escalation_note = """
-        Risk level is elevated. Ask for concrete numbers and owners, and push for clear trade-offs and KPIs.
+        Response cache key for a reply to messages, or None when the reply must not be cached:
+        above temperature 0 replies are sampled, and replaying one verbatim to another session would be wrong.
         """
+        if self.llm_config.temperature != 0:
+            return None
+        return make_cache_key(
+            self.llm_config.provider, self.llm_config.model, messages,
+            self.llm_config.temperature, self._max_tokens(),
+        )
 
-        active_constraints = picked_constraints or []
-
-        prompt = f"""{context}
-
-        Active constraints this round:
-        - """ + "\n- ".join(active_constraints) + f"""
-
-    Respond as {self.name} ({self.role}). Be professional and realistic.
-    {base_rules}
-    {style}
-    {role_focus}
-    {escalation_note}
-    """
+    def _respond_with_llm(
+        self,
+        complication: str,
+        state: Any,
+        user_message: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Generate response using LLM."""
+        messages = self._build_messages(complication, state, user_message)
+        cache_key = self._cache_key(messages)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
 
-        if self.llm_config.provider == "openai":
+        client = self._get_client()
+        if on_token is not None:
+            reply = self._stream_with_llm(client, messages, on_token)
+        elif self.llm_config.provider == "openai":
             response = client.chat.completions.create(
                 model=self.llm_config.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            f"You are {self.name}, a {self.role}. "
-                            "You are participating in a realistic cloud-migration simulation. "
-                            "Follow the user's provided context and the rules in the prompt."
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+                messages=messages,
                 temperature=self.llm_config.temperature,
-                max_tokens=self.llm_config.max_tokens,
+                max_tokens=self._max_tokens(),
             )
-            return response.choices[0].message.content.strip()
+            reply = response.choices[0].message.content.strip()
         else:  # anthropic
             response = client.messages.create(
                 model=self.llm_config.model,
-                max_tokens=self.llm_config.max_tokens,
+                max_tokens=self._max_tokens(),
+                temperature=self.llm_config.temperature,
+                system=_anthropic_system(messages[0]["content"]),
+                messages=messages[1:],
+            )
+            reply = response.content[0].text.strip()
+        if cache_key:
+            response_cache.set(cache_key, reply)
+        return reply
+
+    async def _respond_with_llm_async(
+        self, complication: str, state: Any, user_message: Optional[str] = None
+    ) -> str:
+        """Generate response using the async LLM client."""
+        messages = self._build_messages(complication, state, user_message)
+        cache_key = self._cache_key(messages)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return cached
+
+        client = self._get_async_client()
+        if self.llm_config.provider == "openai":
+            response = await client.chat.completions.create(
+                model=self.llm_config.model,
+                messages=messages,
+                temperature=self.llm_config.temperature,
+                max_tokens=self._max_tokens(),
+            )
+            reply = response.choices[0].message.content.strip()
+        else:  # anthropic
+            response = await client.messages.create(
+                model=self.llm_config.model,
+                max_tokens=self._max_tokens(),
                 temperature=self.llm_config.temperature,
-                messages=[
-                    {"role": "user", "content": prompt},
-                ],
+                system=_anthropic_system(messages[0]["content"]),
+                messages=messages[1:],
             )
-            return response.content[0].text.strip()
+            reply = response.content[0].text.strip()
+        if cache_key:
+            response_cache.set(cache_key, reply)
+        return reply
+
+    def _stream_with_llm(self, client: Any, messages: List[Dict[str, str]], on_token: Callable[[str], None]) -> str:
+        """Stream a completion, passing each text chunk to on_token. Returns the full reply."""
+        chunks: List[str] = []
+        if self.llm_config.provider == "openai":
+            stream = client.chat.completions.create(
+                model=self.llm_config.model,
+                messages=messages,
+                temperature=self.llm_config.temperature,
+                max_tokens=self._max_tokens(),
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    on_token(delta)
+        else:  # anthropic
+            with client.messages.stream(
+                model=self.llm_config.model,
+                max_tokens=self._max_tokens(),
+                temperature=self.llm_config.temperature,
+                system=_anthropic_system(messages[0]["content"]),
+                messages=messages[1:],
+            ) as stream:
+                for text in stream.text_stream:
+                    chunks.append(text)
+                    on_token(text)
+        return "".join(chunks).strip()
 
 
 class PMPersona(Persona):
@@ -458,14 +752,7 @@ class PMPersona(Persona):
     
     def generate_complication(self, state: Any) -> str:
         """Generate PM complication."""
-        complications = [
-            "Deadline shortened: we must ship in 10 days. No full refactor is possible.",
-            "Stakeholders want to see progress this week. Can we show something working quickly?",
-            "The scope has changed - we need to support 3x more users than originally planned.",
-            "Upper management is asking for daily updates. We need a clear migration timeline.",
-            "Customer commitments require zero disruption. How do we ensure smooth transition?"
-        ]
-        return random.choice(complications)
+        return _rng(state).choice(_PM_COMPLICATIONS)
 
 
 class DevOpsPersona(Persona):
@@ -477,14 +764,7 @@ class DevOpsPersona(Persona):
     
     def generate_complication(self, state: Any) -> str:
         """Generate DevOps complication."""
-        complications = [
-            "Access model changes: IAM roles need to map to Azure RBAC. We must pass security review before deployment.",
-            "Infrastructure as Code needs to be rewritten. Our Terraform modules are AWS-specific.",
-            "Monitoring and logging systems are different. We need a migration plan for observability.",
-            "CI/CD pipelines depend on AWS-specific services. We'll need to rebuild them.",
-            "Network security groups and VPC configurations don't translate directly. This affects our architecture."
-        ]
-        return random.choice(complications)
+        return _rng(state).choice(_DEVOPS_COMPLICATIONS)
 
 
 class CTOPersona(Persona):
@@ -496,14 +776,20 @@ class CTOPersona(Persona):
     
     def generate_complication(self, state: Any) -> str:
         """Generate CTO complication."""
-        complications = [
-            "Cost cap added: we have a strict budget. Egress costs and new managed services need careful evaluation.",
-            "Long-term strategy: we're considering multi-cloud. How does this migration fit our 5-year plan?",
-            "Vendor lock-in is a concern. We want to avoid being tied to one provider's proprietary features.",
-            "Team expertise: our engineers know AWS well. Training costs and time for new cloud provider need consideration.",
-            "Compliance requirements: we need to ensure the new provider meets all regulatory standards."
-        ]
-        return random.choice(complications)
+        return _rng(state).choice(_CTO_COMPLICATIONS)
+
+
+# (constraint, persona that owns it), in the order missing constraints are checked
+_PERSONA_BY_CONSTRAINT = (
+    ("security", "DevOps"),
+    ("cost", "CTO"),
+    ("time", "PM"),
+)
+_AVAILABLE_PERSONAS = ("PM", "DevOps", "CTO")
+# Personas eligible to speak after each persona (never the same one twice in a row)
+_CANDIDATES_AFTER = {
+    last: tuple(p for p in _AVAILABLE_PERSONAS if p != last) for last in _AVAILABLE_PERSONAS
+}
 
 
 def choose_next_persona(state: Any) -> str:
@@ -515,67 +801,47 @@ def choose_next_persona(state: Any) -> str:
     2. Prioritize personas matching missing constraints
     3. Rotate through all available personas to ensure diversity
     """
-    available = ["PM", "DevOps", "CTO"]
     last_persona = state.last_persona
+    addressed = state.constraints_addressed
     
-    # Exclude last persona to ensure variety (never repeat consecutive)
-    candidates = [p for p in available if p != last_persona]
+    # Exclude last persona to ensure variety (never repeat consecutive); all are eligible in the first round
+    candidates = _CANDIDATES_AFTER.get(last_persona, _AVAILABLE_PERSONAS)
     
-    # If this is the first round, choose randomly or based on constraints
-    if not last_persona:
-        # Map constraints to personas
-        constraint_to_persona = {
-            "security": "DevOps",
-            "cost": "CTO",
-            "time": "PM"
-        }
-        
-        # Check for missing constraints
-        for constraint, persona in constraint_to_persona.items():
-            if constraint not in state.constraints_addressed:
-                return persona
-        
-        # No missing constraints - start with first available
-        return available[0]
-    
-    # Not first round - ensure we pick someone different
-    if len(candidates) == 1:
-        return candidates[0]
-    
-    # Map constraints to personas
-    constraint_to_persona = {
-        "security": "DevOps",
-        "cost": "CTO",
-        "time": "PM"
-    }
-    
-    # Find candidates that match missing constraints
-    matching_personas = []
-    for constraint, persona in constraint_to_persona.items():
-        if constraint not in state.constraints_addressed and persona in candidates:
-            matching_personas.append(persona)
+    # Prefer candidates that own a missing constraint, else any candidate
+    matching_personas = [
+        persona for constraint, persona in _PERSONA_BY_CONSTRAINT
+        if constraint not in addressed and persona in candidates
+    ]
+    pool = matching_personas or candidates
     
-    # If we have personas matching missing constraints, prefer them
-    if matching_personas:
-        # Use round number to alternate between matching personas
-        return matching_personas[state.round_count % len(matching_personas)]
-    
-    # No matching constraints - rotate through all candidates
-    # Use round number to cycle through, ensuring we don't repeat last
-    # This creates variety: if last was PM, next could be DevOps or CTO
-    return candidates[state.round_count % len(candidates)]
+    # First round: take the first in order. Later rounds: use the round number to rotate
+    # through the pool (e.g. if last was PM, next alternates between DevOps and CTO)
+    if not last_persona:
+        return pool[0]
+    return pool[state.round_count % len(pool)]
+
+
+# One instance per (persona name, config object); personas hold no per-session state
+_PERSONA_CACHE: Dict[Tuple[str, int], Persona] = {}
 
 
 def get_persona_instance(persona_name: str, llm_config: LLMConfig) -> Persona:
-    """Get persona instance by name."""
+    """Get persona instance by name (shared across rounds and sessions for the same config)."""
+    key = (persona_name, id(llm_config))
+    inst = _PERSONA_CACHE.get(key)
+    # Identity check guards against a reused id() after a config object is freed
+    if inst is not None and inst.llm_config is llm_config:
+        return inst
     if persona_name == "PM":
-        return PMPersona(llm_config)
+        inst = PMPersona(llm_config)
     elif persona_name == "DevOps":
-        return DevOpsPersona(llm_config)
+        inst = DevOpsPersona(llm_config)
     elif persona_name == "CTO":
-        return CTOPersona(llm_config)
+        inst = CTOPersona(llm_config)
     else:
         raise ValueError(f"Unknown persona: {persona_name}")
+    _PERSONA_CACHE[key] = inst
+    return inst
 
 
 def generate_complication(state: Any, persona: Persona) -> str:
@@ -598,11 +864,13 @@ def generate_complication(state: Any, persona: Persona) -> str:
     if hasattr(state, "target_cost_reduction_pct"):
         baseline_lines.append(f"Cost target: reduce by {state.target_cost_reduction_pct}%.")
 
+    seed = _user_seed(state)
+
     # dependencies (very realistic)
     deps = getattr(state, "critical_dependencies", None)
     if deps:
         # include 1 dependency per round to avoid overload
-        idx = (hash(state.user_id) + state.round_count) % len(deps)
+        idx = (seed + state.round_count) % len(deps)
         baseline_lines.append(f"Known dependency: {deps[idx]}")
 
     baseline = " ".join(baseline_lines).strip()
@@ -648,13 +916,7 @@ def generate_complication(state: Any, persona: Persona) -> str:
     # --- 4) Occasional twist (company chaos) every 2nd round ---
     twist = ""
     if state.round_count % 2 == 0:
-        twists = [
-            "New info: Security blocks new deployments this week unless risk is low.",
-            "Incident: a production alert fired; leadership wants zero risky changes for 48 hours.",
-            "Customer pressure: enterprise client reports latency regression; +10ms max allowed.",
-            "Hidden dependency discovered: a legacy service calls AWS SDK directly with no tests."
-        ]
-        twist = twists[(hash(state.user_id) + state.round_count) % len(twists)]
+        twist = _TWISTS[(seed + state.round_count) % len(_TWISTS)]
 
     # Fallback to persona's own complication, but enriched
     persona_comp = persona.generate_complication(state)
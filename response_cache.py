@@ -0,0 +1,119 @@
+"""Exact-match cache for LLM responses (SQLite-backed, shared across sessions)."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Stored next to the validate_api cache (see config.VALIDATION_CACHE_PATH)
+RESPONSE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "cloudmig", "responses.sqlite3")
+RESPONSE_CACHE_TTL_SECONDS = 1800
+# Recent entries also kept in process memory (LRU) so repeat hits skip SQLite
+RESPONSE_CACHE_MEMORY_SIZE = 256
+
+
+def make_cache_key(provider: str, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """Hash everything that determines the LLM output into a cache key."""
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match LLM response cache with a TTL: an in-memory LRU in front of SQLite.
+    The cache is best-effort: any SQLite error is treated as a miss.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+        memory_size: int = RESPONSE_CACHE_MEMORY_SIZE,
+    ):
+        """Initialize cache; the database is opened on first use."""
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # key -> (response, expiry)
+        self._memory: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+
+    def _remember(self, key: str, response: str, expiry: int) -> None:
+        """Put an entry in the memory LRU, evicting the oldest. Caller holds the lock."""
+        self._memory[key] = (response, expiry)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """Open the database and create the schema (lazy initialization). Caller holds the lock."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response BLOB, expiry INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_expiry ON responses (expiry)")
+            # The file persists across runs, so drop whatever expired since it was last used
+            conn.execute("DELETE FROM responses WHERE expiry <= ?", (int(time.time()),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None if missing/expired."""
+        now = int(time.time())
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    return entry[0]
+                del self._memory[key]
+            try:
+                row = self._get_conn().execute(
+                    "SELECT response, expiry FROM responses WHERE key = ? AND expiry > ?",
+                    (key, now),
+                ).fetchone()
+            except (OSError, sqlite3.Error):
+                return None
+            if row is None:
+                return None
+            response: Any = row[0]
+            if isinstance(response, bytes):
+                response = response.decode("utf-8")
+            self._remember(key, response, row[1])
+        return response
+
+    def set(self, key: str, response: str) -> None:
+        """Store a response under key for ttl_seconds, deleting expired rows."""
+        now = int(time.time())
+        expiry = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, response, expiry)
+            try:
+                conn = self._get_conn()
+                # Expired rows are never read again; pruning on write keeps the file bounded
+                conn.execute("DELETE FROM responses WHERE expiry <= ?", (now,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, expiry) VALUES (?, ?, ?)",
+                    (key, response.encode("utf-8"), expiry),
+                )
+                conn.commit()
+            except (OSError, sqlite3.Error):
+                pass
+
+
+# Global cache instance shared by the parser and personas
+response_cache = ResponseCache()
@@ -1,7 +1,7 @@
 """Scenario generation for AWS migration simulations."""
 
 import random
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 
 
@@ -173,22 +173,31 @@ BUSINESS_CONTEXTS = [
 ]
 
 # Constraint pool
-ALL_CONSTRAINTS = ["time", "cost", "security", "perf", "downtime", "partial_docs"]
+ALL_CONSTRAINTS = ("time", "cost", "security", "perf", "downtime", "partial_docs")
 
+# Per business context (same index): pool constraints not already in its base list, in pool order
+_EXTRA_CONSTRAINTS = tuple(
+    tuple(c for c in ALL_CONSTRAINTS if c not in ctx["constraints"]) for ctx in BUSINESS_CONTEXTS
+)
 
-def randomize_variant() -> Dict[str, Any]:
+# Module RNG for scenario picks; callers may pass their own (e.g. seeded) instance
+_rng = random.Random()
+
+
+def randomize_variant(rng: Optional[random.Random] = None) -> Dict[str, Any]:
     """Randomly select a scenario variant."""
-    service_combo = random.choice(SERVICE_COMBINATIONS)
-    business_context = random.choice(BUSINESS_CONTEXTS)
+    rng = rng or _rng
+    service_combo = rng.choice(SERVICE_COMBINATIONS)
+    context_index = rng.randrange(len(BUSINESS_CONTEXTS))
+    business_context = BUSINESS_CONTEXTS[context_index]
     
     # Combine base constraints from business context with additional random constraints
-    base_constraints = business_context["constraints"].copy()
-    remaining_constraints = [c for c in ALL_CONSTRAINTS if c not in base_constraints]
+    remaining_constraints = _EXTRA_CONSTRAINTS[context_index]
     
     # Add 1-2 additional constraints randomly
-    num_additional = random.randint(1, 2)
-    additional = random.sample(remaining_constraints, min(num_additional, len(remaining_constraints)))
-    all_constraints = base_constraints + additional
+    num_additional = rng.randint(1, 2)
+    additional = rng.sample(remaining_constraints, min(num_additional, len(remaining_constraints)))
+    all_constraints = business_context["constraints"] + additional
     
     return {
         "services": service_combo["services"],
@@ -1,13 +1,46 @@
 """Main simulation controller."""
 
-from typing import Optional
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
 
 from state import State, init_state
 from scenario import scenario_generator, present_context, ScenarioPacket
 from parser import UserResponseParser
-from personas import choose_next_persona, get_persona_instance, generate_complication
+from personas import Persona, choose_next_persona, get_persona_instance, generate_complication
 from evaluation import evaluate_session, format_feedback, format_final_review_message, detect_gaps, EvaluationReport
-from config import config
+from config import aclose_async_clients, config
+
+
+# All personas, in display order (each controller holds one of each; all reply in aprocess_user_input_multi)
+MULTI_PERSONA_ORDER = ("PM", "DevOps", "CTO")
+
+# Parser shared by every controller (extraction is not per-user, so its cache is shared too)
+_PARSER: Optional[UserResponseParser] = None
+_PARSER_LOCK = threading.Lock()
+
+# (provider, api_key) pairs whose client was already warmed in this process
+_WARMED_CLIENTS: set = set()
+
+
+def _get_shared_parser() -> UserResponseParser:
+    """Return the process-wide parser for config.llm_config, creating it on first use."""
+    global _PARSER
+    parser = _PARSER
+    if parser is None or parser.llm_config is not config.llm_config:
+        with _PARSER_LOCK:
+            parser = _PARSER
+            if parser is None or parser.llm_config is not config.llm_config:
+                parser = _PARSER = UserResponseParser(config.llm_config)
+    return parser
+
+
+@dataclass
+class RoundSnapshot:
+    """Round information plus the live state, fetched together for display."""
+    round_info: dict
+    state: State
 
 
 class SimulationController:
@@ -16,22 +49,107 @@ class SimulationController:
     def __init__(self, user_id: str):
         """Initialize simulation with user ID."""
         self.state = init_state(user_id)
-        self.parser = UserResponseParser(config.llm_config)
+        self.parser = _get_shared_parser()
+        # Every persona is used within a few turns, so resolve them once up front
+        self._personas = {name: get_persona_instance(name, config.llm_config) for name in MULTI_PERSONA_ORDER}
         self.context_packet: Optional[ScenarioPacket] = None
         self._last_report: Optional[EvaluationReport] = None
     
     def initialize(self) -> str:
         """Initialize simulation and return initial context message."""
+        llm_config = config.llm_config
+        warm_key = (llm_config.provider, llm_config.api_key)
+        if llm_config.api_key and warm_key not in _WARMED_CLIENTS:
+            # Warm the shared LLM client while the user reads the scenario
+            _WARMED_CLIENTS.add(warm_key)
+            threading.Thread(target=llm_config.warm_up, daemon=True).start()
         self.context_packet = scenario_generator(self.state)
         agent_message = present_context(self.context_packet)
         self.state.add_message("agent", agent_message)
         return agent_message
     
-    def process_user_input(self, user_message: str) -> tuple[Optional[str], bool]:
+    def process_user_input(
+        self, user_message: str, on_token: Optional[Callable[[str], None]] = None
+    ) -> tuple[Optional[str], bool]:
         """
         Process user input and return agent response.
+        If on_token is given, persona replies are streamed to it chunk by chunk.
         Returns: (agent_response, should_end)
         """
+        response, should_end, persona, complication = self._handle_user_turn(user_message)
+        if persona is None:
+            return response, should_end
+
+        # Generate persona response
+        agent_reply = persona.respond_as_persona(complication, self.state, user_message, on_token)
+        return self._record_persona_reply(persona, agent_reply), False
+
+    async def aprocess_user_input(self, user_message: str) -> tuple[Optional[str], bool]:
+        """
+        Async variant of process_user_input for event-loop hosts.
+        Parsing runs in a worker thread; the persona reply awaits the async LLM client.
+        """
+        response, should_end, persona, complication = await asyncio.to_thread(self._handle_user_turn, user_message)
+        if persona is None:
+            return response, should_end
+
+        agent_reply = await persona.respond_as_persona_async(complication, self.state, user_message)
+        return self._record_persona_reply(persona, agent_reply), False
+
+    async def aprocess_user_input_multi(
+        self, user_message: str, semaphore: Optional[asyncio.Semaphore] = None
+    ) -> tuple[Optional[str], bool]:
+        """
+        Like aprocess_user_input, but PM, DevOps and CTO all reply to the turn, concurrently.
+        The replies are recorded in that order and returned joined by blank lines.
+        Pass a shared semaphore to cap in-flight LLM calls across many simulations.
+        """
+        ended = await asyncio.to_thread(self._advance_turn, user_message)
+        if ended is not None:
+            return ended
+
+        pairs = []
+        for persona_name in MULTI_PERSONA_ORDER:
+            persona = self._personas[persona_name]
+            pairs.append((persona, generate_complication(self.state, persona)))
+            self.state.personas_triggered.add(persona_name)
+        self.state.last_persona = MULTI_PERSONA_ORDER[-1]
+
+        async def _reply(persona: Persona, complication: str) -> str:
+            if semaphore is None:
+                return await persona.respond_as_persona_async(complication, self.state, user_message)
+            async with semaphore:
+                return await persona.respond_as_persona_async(complication, self.state, user_message)
+
+        replies = await asyncio.gather(*(_reply(p, c) for p, c in pairs))
+        formatted = [self._record_persona_reply(p, reply) for (p, _), reply in zip(pairs, replies)]
+        return "\n\n".join(formatted), False
+
+    def _handle_user_turn(
+        self, user_message: str
+    ) -> tuple[Optional[str], bool, Optional[Persona], Optional[str]]:
+        """
+        Record and parse the user's message, then decide what happens this turn.
+        Returns (response, should_end, None, None) when the turn is answered without a persona
+        (final review / feedback), otherwise (None, False, persona, complication) for the persona to reply.
+        """
+        ended = self._advance_turn(user_message)
+        if ended is not None:
+            return (*ended, None, None)
+
+        # Choose next persona and generate complication
+        persona_name = choose_next_persona(self.state)
+        persona = self._personas[persona_name]
+        complication = generate_complication(self.state, persona)
+        self.state.personas_triggered.add(persona_name)
+        self.state.last_persona = persona_name  # Track last persona for variety
+        return None, False, persona, complication
+
+    def _advance_turn(self, user_message: str) -> Optional[tuple[str, bool]]:
+        """
+        Record and parse the user's message.
+        Returns (response, should_end) when the turn is answered without a persona, else None.
+        """
         # Add user message to history
         self.state.add_message("user", user_message)
         self.state.round_count += 1
@@ -60,37 +178,32 @@ class SimulationController:
             review_message = format_final_review_message(self.state)
             self.state.add_message("agent", review_message)
             return review_message, False
-        
-        # Choose next persona and generate complication
-        persona_name = choose_next_persona(self.state)
-        persona = get_persona_instance(persona_name, config.llm_config)
-        complication = generate_complication(self.state, persona)
-        self.state.personas_triggered.add(persona_name)
-        self.state.last_persona = persona_name  # Track last persona for variety
-        
-        # Generate persona response
-        agent_reply = persona.respond_as_persona(complication, self.state, user_message)
-        
-        # Format with persona name
+        return None
+
+    def _record_persona_reply(self, persona: Persona, agent_reply: str) -> str:
+        """Format a persona reply with its name and add it to history."""
         formatted_reply = f"[{persona.name} ({persona.role})]: {agent_reply}"
         self.state.add_message("agent", formatted_reply)
-        
-        return formatted_reply, False
+        return formatted_reply
     
     def get_state(self) -> State:
         """Get current simulation state."""
         return self.state
     
     def get_round_info(self) -> dict:
-        """Get current round information."""
+        """Get current round information (collections are immutable tuple snapshots)."""
         return {
             "round": self.state.round_count,
             "max_rounds": self.state.max_rounds,
-            "personas_triggered": list(self.state.personas_triggered),
-            "constraints_addressed": list(self.state.constraints_addressed),
+            "personas_triggered": tuple(self.state.personas_triggered),
+            "constraints_addressed": tuple(self.state.constraints_addressed),
             "strategy": self.state.strategy_selected
         }
 
+    def get_round_snapshot(self) -> RoundSnapshot:
+        """Get round information and state in one call (state is shared, not copied)."""
+        return RoundSnapshot(round_info=self.get_round_info(), state=self.state)
+
     def get_last_report(self) -> Optional[EvaluationReport]:
         """Return the evaluation report from the last completed simulation (if any)."""
         return self._last_report
@@ -100,3 +213,37 @@ def run_simulation(user_id: str) -> SimulationController:
     """Create and initialize a new simulation."""
     simulation = SimulationController(user_id)
     return simulation
+
+
+async def arun_simulation(user_id: str) -> SimulationController:
+    """Create and initialize a new simulation for an event-loop host (setup runs in a worker thread)."""
+    simulation = await asyncio.to_thread(SimulationController, user_id)
+    await asyncio.to_thread(simulation.initialize)
+    return simulation
+
+
+async def run_simulations_bulk(
+    user_ids: List[str],
+    driver: Callable[[SimulationController], Awaitable[None]],
+    max_concurrency: int = 10,
+) -> List[SimulationController]:
+    """
+    Run one simulation per user ID concurrently, e.g. for offline evaluation.
+    driver plays each initialized simulation (typically via aprocess_user_input);
+    at most max_concurrency simulations run at once. Returns the controllers in user_ids order.
+    The loop's async LLM clients are closed when the run finishes.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _one(user_id: str) -> SimulationController:
+        async with semaphore:
+            simulation = await arun_simulation(user_id)
+            await driver(simulation)
+            return simulation
+
+    try:
+        return list(await asyncio.gather(*(_one(user_id) for user_id in user_ids)))
+    finally:
+        await aclose_async_clients()
@@ -2,29 +2,68 @@
 
 import uuid
 import os
+import random
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Set, Optional, Dict, Any
+from typing import List, Set, Optional, Dict, Any, Tuple
 
 from config import CompletionConditions, config
 
 # Canonical constraint names (must match parser.VALID_CONSTRAINTS)
 _VALID_CONSTRAINTS = {"time", "cost", "security", "perf", "downtime", "partial_docs"}
 
+# (parser flag, deliverable that is missing when the flag is not set)
+_DELIVERABLE_FLAGS = (
+    ("mentioned_timeline", "timeline"),
+    ("mentioned_cost", "cost"),
+    ("mentioned_rollback", "rollback"),
+    ("mentioned_downtime_or_slo", "downtime_slo"),
+    ("mentioned_tradeoff", "tradeoff"),
+)
+# Risk points per missing deliverable
+_MISSING_RISK_POINTS = {"rollback": 20, "timeline": 10}
+# Risk points per strategy, at any budget
+_STRATEGY_RISK_POINTS = {"rewrite": 15}  # generally risky under time pressure
+# Risk points per (strategy, budget level)
+_STRATEGY_BUDGET_RISK_POINTS = {("kubernetes", "low"): 15, ("multi_cloud", "low"): 15}
+
+
+@dataclass(slots=True)
+class Message:
+    """One chat message in the session history."""
+    role: str  # "user" or "agent"
+    content: str
+    round: int
+    timestamp: float = field(default_factory=time.time)  # epoch seconds; formatted only in to_dict()
+    metadata: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable form (ISO timestamp; metadata only when present)."""
+        message = {
+            "role": self.role,
+            "content": self.content,
+            "round": self.round,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat()
+        }
+        if self.metadata:
+            message["metadata"] = self.metadata
+        return message
 
-@dataclass
+
+@dataclass(slots=True)
 class State:
     """Simulation state tracking."""
     session_id: str
     user_id: str
     scenario_variant: Optional[Dict[str, Any]] = None
     round_count: int = 0
-    max_rounds: int = os.environ.get("SIMULATION_MAX_ROUNDS", 4)
+    max_rounds: int = field(default_factory=lambda: int(os.environ.get("SIMULATION_MAX_ROUNDS", 4)))
     personas_triggered: Set[str] = field(default_factory=set)
     constraints_addressed: Set[str] = field(default_factory=set)
     strategy_selected: Optional[str] = None
-    risk_flags: List[str] = field(default_factory=list)
-    history: List[Dict[str, Any]] = field(default_factory=list)
+    risk_flags: Dict[str, None] = field(default_factory=dict)  # insertion-ordered set of flag names
+    history: List[Message] = field(default_factory=list)
     start_time: datetime = field(default_factory=datetime.now)
     deadline_virtual: str = "T+2 weeks"
     last_persona: Optional[str] = None  # Track last persona to ensure variety
@@ -38,6 +77,22 @@ class State:
     last_extracted: Dict[str, Any] = field(default_factory=dict)
     missing_deliverables: Set[str] = field(default_factory=set)  # e.g. {"timeline","rollback","cost"}
     risk_score: int = 0  # 0-100
+    # Per-session persona context, chosen once and then reused (set in personas.py)
+    info_gap_key: Optional[str] = None
+    info_gap_text: Optional[str] = None
+    org_pressure_text: Optional[str] = None
+    selected_hidden_constraint: Optional[str] = None
+    last_constraints_shown: Set[str] = field(default_factory=set)
+    # (messages seen, lowercased message texts) for history_text(); history is append-only
+    _history_text_cache: Optional[Tuple[int, str]] = field(default=None, init=False, repr=False, compare=False)
+    # (constraints seen, sorted constraints joined for prompts) for constraints_text(); the set only grows
+    _constraints_text_cache: Optional[Tuple[int, str]] = field(default=None, init=False, repr=False, compare=False)
+    # (company facts, persona system-prompt prefix) shared by all personas (set in personas.py)
+    _shared_prefix_cache: Optional[Tuple[Tuple[str, ...], str]] = field(default=None, init=False, repr=False, compare=False)
+    # Per-session RNG for persona picks (set in personas.py)
+    _rng: Optional[random.Random] = field(default=None, init=False, repr=False, compare=False)
+    # hash(user_id) for persona dependency/twist rotation (set in personas.py)
+    _user_id_hash: Optional[int] = field(default=None, init=False, repr=False, compare=False)
 
 
     def should_end(self, completion_conditions: CompletionConditions) -> bool:
@@ -76,56 +131,48 @@ class State:
 
         # Check for risk flags
         if self.strategy_selected == "rewrite" and "time" in self.constraints_addressed:
-            risk_flag = "rewrite_conflicts_with_time_pressure"
-            if risk_flag not in self.risk_flags:
-                self.risk_flags.append(risk_flag)
+            self.risk_flags.setdefault("rewrite_conflicts_with_time_pressure", None)
 
         # Save last extracted for adaptive realism 
         self.last_extracted = extracted or {}
 
-        # Compute missing deliverables (CTO realism: gate on missing essentials)
-        missing = set()
-
+        # Compute missing deliverables (CTO realism: gate on missing essentials).
         # These keys may or may not exist in your parser output yet.
         # If they don't exist, they'll default to missing -> which is OK for now.
-        if not extracted.get("mentioned_timeline"):
-            missing.add("timeline")
-        if not extracted.get("mentioned_cost"):
-            missing.add("cost")
-        if not extracted.get("mentioned_rollback"):
-            missing.add("rollback")
-        if not extracted.get("mentioned_downtime_or_slo"):
-            missing.add("downtime_slo")
-        if not extracted.get("mentioned_tradeoff"):
-            missing.add("tradeoff")
+        missing = {deliverable for flag, deliverable in _DELIVERABLE_FLAGS if not extracted.get(flag)}
 
         self.missing_deliverables = missing
 
-        # --- Risk scoring (simple, interpretable) ---
-        risk = 0
-        if "rollback" in missing:
-            risk += 20
-        if "timeline" in missing:
-            risk += 10
-        if self.strategy_selected in {"kubernetes", "multi_cloud"} and self.budget_level == "low":
-            risk += 15
-        if self.strategy_selected == "rewrite":
-            risk += 15  # generally risky under time pressure
+        # --- Risk scoring (simple, interpretable; weights live in the module-level tables) ---
+        risk = sum(_MISSING_RISK_POINTS.get(m, 0) for m in missing)
+        risk += _STRATEGY_RISK_POINTS.get(self.strategy_selected, 0)
+        risk += _STRATEGY_BUDGET_RISK_POINTS.get((self.strategy_selected, self.budget_level), 0)
 
         self.risk_score = min(100, risk)
 
 
+    def history_text(self) -> str:
+        """Lowercased message texts of the whole history; only messages added since the last call are processed."""
+        count, text = self._history_text_cache or (0, "")
+        if count > len(self.history):
+            count, text = 0, ""
+        if count != len(self.history):
+            added = "\n".join(m.content for m in self.history[count:]).lower()
+            text = f"{text}\n{added}" if text else added
+            self._history_text_cache = (len(self.history), text)
+        return text
+
+    def constraints_text(self) -> str:
+        """Addressed constraints as a sorted, comma-joined string (stable across turns); rebuilt only when the set grows."""
+        cached = self._constraints_text_cache
+        if cached is None or cached[0] != len(self.constraints_addressed):
+            cached = (len(self.constraints_addressed), ", ".join(sorted(self.constraints_addressed)))
+            self._constraints_text_cache = cached
+        return cached[1]
+
     def add_message(self, role: str, content: str, metadata: Optional[Dict] = None) -> None:
         """Add a message to history."""
-        message = {
-            "role": role,  # "user" or "agent"
-            "content": content,
-            "round": self.round_count,
-            "timestamp": datetime.now().isoformat()
-        }
-        if metadata:
-            message["metadata"] = metadata
-        self.history.append(message)
+        self.history.append(Message(role, content, self.round_count, metadata=metadata or None))
 
 
 def init_state(user_id: str) -> State:
@@ -133,7 +180,7 @@ def init_state(user_id: str) -> State:
     s = State(
         session_id=str(uuid.uuid4()),
         user_id=user_id,
-        max_rounds=config.max_rounds
+        max_rounds=int(config.max_rounds)
     )
 
     # --- Real company baseline (feel free to tweak) ---